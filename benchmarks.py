@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import busgy2
+from busgy2 import (Pokemon, StatModifier, Odds, TurnActions, LRUCache, TOTODILE, RAGE, MIN_RANGE, MAX_RANGE,
+                    elementalBadgeBoosts, metapod, kakuna, scyther, calc_damage, allNormalDamage, allCritDamage,
+                    perform_ai_turn, extract_move_odds)
+
+# Micro-benchmarks of the hot functions of busgy2.py, on fixed inputs drawn from a seeded random generator.
+# python benchmarks.py --save stores the results as the baseline, later runs are compared against it.
+SEED = 2023
+INPUTS = 256  # inputs drawn per benchmark, each timed call uses the next one
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+
+
+#
+# Inputs
+#
+def totodile():
+    return Pokemon(TOTODILE, 16, [0]*4,
+                   868, 868, 1108, 1108, 1019, 1019, 1203, 1203, 800, 800,
+                   [RAGE], False,
+                   elementalBadgeBoosts, atkBadge=True, defBadge=False, spdBadge=False, spcBadge=False,
+                   totalExp=2733)
+
+
+def enemies():
+    return [metapod.__copy__(), kakuna.__copy__(), scyther.__copy__()]
+
+
+def randomMod(rng: random.Random):
+    return StatModifier(atk=rng.randint(-2, 2), deff=rng.randint(-2, 2), spd=rng.randint(-2, 0),
+                        rageNb=rng.randint(1, 8), furycutterNb=rng.randint(0, 3), turn=rng.randint(1, 12))
+
+
+def randomOdds(rng: random.Random):
+    return Odds(rng.randint(1, 39 ** 3), 39 ** rng.randint(3, 6) * 256 ** rng.randint(0, 3))
+
+
+def randomTurn(rng: random.Random):
+    player = totodile()
+    enemy = rng.choice(enemies())
+    player.currHP = rng.randint(1, player.hp)
+    enemy.currHP = rng.randint(1, enemy.hp)
+    return TurnActions('', player, enemy, randomMod(rng), randomMod(rng), randomOdds(rng))
+
+
+#
+# Benchmarks
+#
+# name -> function drawing the arguments of one call from rng, function called
+def calcDamageInputs(rng):
+    player, enemy = totodile(), rng.choice(enemies())
+    move, attacker, defender = (RAGE, player, enemy) if rng.random() < 0.5 else (rng.choice(enemy.moves), enemy, player)
+    return (move, attacker, defender, randomMod(rng), randomMod(rng), rng.randint(MIN_RANGE, MAX_RANGE),
+            rng.random() < 0.5, rng.randint(1, 8))
+
+
+def allDamageInputs(rng):
+    enemy = rng.choice(enemies())
+    return RAGE, totodile(), enemy, randomMod(rng), randomMod(rng), rng.randint(1, 8)
+
+
+def aiInputs(rng):
+    enemy = rng.choice(enemies())
+    enemy.currHP = rng.randint(1, enemy.hp)
+    return enemy.moves, randomMod(rng), randomMod(rng), totodile(), enemy
+
+
+def aiTurn(moves, playerMod, enemyMod, player, enemy):
+    return extract_move_odds(perform_ai_turn(moves, playerMod, enemyMod, player, enemy))
+
+
+def oddsInputs(rng):
+    return randomOdds(rng), randomOdds(rng), randomOdds(rng)
+
+
+def oddsArithmetic(a, b, c):
+    return a * b + c
+
+
+def gainExpInputs(rng):
+    return totodile(), rng.choice(enemies()).expGiven()
+
+
+def gainExp(pokemon: Pokemon, exp):
+    pokemon = pokemon.__copy__()  # the same work on every call
+    pokemon.gainExp(exp)
+    return pokemon
+
+
+BENCHMARKS = {
+    'calc_damage': (calcDamageInputs, calc_damage),
+    'allNormalDamage': (allDamageInputs, allNormalDamage),
+    'allCritDamage': (allDamageInputs, allCritDamage),
+    'perform_ai_turn+extract_move_odds': (aiInputs, aiTurn),
+    'Odds a*b+c': (oddsInputs, oddsArithmetic),
+    'TurnActions.__copy__': (lambda rng: (randomTurn(rng),), TurnActions.__copy__),
+    'Pokemon.gainExp': (gainExpInputs, gainExp),  # includes a Pokemon.__copy__
+}
+UNCACHED = {'allNormalDamage', 'allCritDamage'}  # also benchmarked with damage_cache disabled
+
+
+def timeBenchmark(draw, function, seconds, repeats):
+    """Best ops/sec over repeats runs of about seconds each, every call using new inputs"""
+    rng = random.Random(SEED)
+    inputs = [draw(rng) for _ in range(INPUTS)]
+    for args in inputs:  # warm up, and fills the caches
+        function(*args)
+
+    calls = 1
+    while True:  # calls per run
+        start = time.perf_counter()
+        for i in range(calls):
+            function(*inputs[i % INPUTS])
+        if time.perf_counter() - start >= seconds / 10:
+            break
+        calls *= 2
+    calls *= 10
+
+    best = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(calls):
+            function(*inputs[i % INPUTS])
+        best = max(best, calls / (time.perf_counter() - start))
+    return best
+
+
+def allocations(draw, function):
+    """(peak bytes allocated, blocks still allocated) per call, on INPUTS calls"""
+    rng = random.Random(SEED)
+    inputs = [draw(rng) for _ in range(INPUTS)]
+    function(*inputs[0])
+    results = []
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    for args in inputs:
+        results.append(function(*args))
+    retained = sys.getallocatedblocks() - blocks
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / INPUTS, retained / INPUTS
+
+
+def runBenchmarks(seconds=0.2, repeats=5, names=None):
+    results = {}
+    for name, (draw, function) in BENCHMARKS.items():
+        variants = [(name, LRUCache(4096))]
+        if name in UNCACHED:
+            variants.append((name + ' (uncached)', LRUCache(0)))
+        for variant, cache in variants:
+            if names and variant not in names:
+                continue
+            busgy2.damage_cache = cache
+            busgy2.ai_cache.clear()
+            ops = timeBenchmark(draw, function, seconds, repeats)
+            peak_bytes, blocks = allocations(draw, function)
+            results[variant] = {'ops_per_s': round(ops), 'peak_bytes_per_call': round(peak_bytes, 1),
+                                'blocks_per_call': round(blocks, 2)}
+            print(f'{variant:40} {ops:14,.0f} ops/s {peak_bytes:10.1f} B/call {blocks:8.2f} blocks/call')
+    busgy2.damage_cache = LRUCache(4096)
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Benchmarks slower, or allocating more, than baseline by more than threshold (a ratio)"""
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        if result['ops_per_s'] < before['ops_per_s'] * (1 - threshold):
+            found.append(f'{name}: {before["ops_per_s"]:,} -> {result["ops_per_s"]:,} ops/s')
+        if result['peak_bytes_per_call'] > before['peak_bytes_per_call'] * (1 + threshold) + 1:
+            found.append(f'{name}: {before["peak_bytes_per_call"]} -> {result["peak_bytes_per_call"]} B/call')
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of busgy2.py')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all by default')
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown flagged as a regression')
+    parser.add_argument('--seconds', type=float, default=0.2, help='duration of each timed run')
+    parser.add_argument('--repeats', type=int, default=5, help='timed runs per benchmark, the best one is kept')
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.seconds, args.repeats, args.names)
+    if args.save:
+        with open(args.baseline, 'w') as file:
+            json.dump({'python': sys.version.split()[0], 'results': results}, file, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file)['results'], args.threshold)
+        print(*found or ['No regression'], sep='\n')
+        sys.exit(1 if found else 0)
+    else:
+        print(f'No baseline at {args.baseline}, run with --save to create one')
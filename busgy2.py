@@ -1,10 +1,32 @@
-import copy
+import argparse
+import hashlib
+import json
+import mmap
+import os
 import pickle
+import queue
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from itertools import accumulate, repeat
 from enum import Enum
+from fractions import Fraction
+from heapq import heappush, heappop
 from math import floor, ceil, sqrt, gcd
+from types import MappingProxyType
+
+try:
+    import numpy as np  # only needed by calc_damage_batch
+except ImportError:
+    np = None
 
 # Only handles Bugsy, Totodile spams Rage
-# TurnActions.MAX_BAD_OUTCOME limits the search space per fought enemy
+# TurnActions.MAX_BAD_OUTCOME limits the search space per fought enemy, unless prune_epsilon limits it instead
 #   a "bad outcome" is increasing the enemy defense/lowering the player speed or defense/enemy missing a damaging move/poison
 
 
@@ -95,6 +117,8 @@ KAKUNA = Species("Kakuna", 14, Type.BUG, Type.POISON, 45, 25, 50, 25, 25, 35, 71
 SCYTHER = Species("Scyther", 123, Type.BUG, Type.FLYING, 70, 110, 80, 55, 80, 105, 187, ExpCurve.MEDIUM_FAST)
 TOTODILE = Species("Totodile", 158, Type.WATER, Type.NONE, 50, 65, 64, 44, 48, 43, 66, ExpCurve.MEDIUM_SLOW)
 
+SPECIES_BY_DEX = {species.dex: species for species in [METAPOD, KAKUNA, SCYTHER, TOTODILE]}
+
 
 #
 # Pokemon
@@ -137,9 +161,16 @@ class Pokemon:
         self.isPoisoned = isPoisoned
 
     def __copy__(self):
-        copyy = copy.deepcopy(self)
+        # species, ivs, moves and badges are never modified during a fight : they are shared, not copied
+        copyy = Pokemon.__new__(Pokemon)
+        copyy.__dict__.update(self.__dict__)
         return copyy
 
+    def __setstate__(self, state):
+        if 'isPoison' in state:  # pickled by bugsy.py
+            state['isPoisoned'] = state.pop('isPoison')
+        self.__dict__.update(state)
+
     def __repr__(self):
         return f'L{self.level} {self.species.name} ({self.hp}/{self.atk}/{self.deff}/{self.spd}/{self.spcAtk}/{self.spcDef}) currHP={self.currHP}'
 
@@ -248,6 +279,9 @@ QUICK_ATTACK = Move("Quick Attack", 98, MoveEffect.PRIORITY_HIT, 40, Type.NORMAL
 LEER = Move("Leer", 43, MoveEffect.DEFENSE_DOWN, 0, Type.NORMAL, 100, 30, 0)
 RAGE = Move("Rage", 99, MoveEffect.RAGE, 20, Type.NORMAL, 100, 20, 0)
 
+MOVES_BY_INDEX = {move.index: move for move in [TACKLE, HARDEN, STRING_SHOT, POISON_STING, FURY_CUTTER, QUICK_ATTACK,
+                                                LEER, RAGE]}
+
 
 #
 # StatModifier
@@ -271,7 +305,9 @@ class StatModifier:
         self.turn = turn
 
     def __copy__(self):
-        return copy.deepcopy(self)
+        copyy = StatModifier.__new__(StatModifier)
+        copyy.__dict__.update(self.__dict__)
+        return copyy
 
     def __repr__(self):
         return f'(stages={self.atk}/{self.deff}/{self.spd}/{self.spcAtk}/{self.spcDef}) {self.rageNb=} {self.furycutterNb=} {self.turn=}'
@@ -320,6 +356,48 @@ class StatModifier:
         return a
 
 
+#
+# Cache
+#
+class LRUCache:
+    """Bounded dict dropping the least recently used entries, counting hits and misses"""
+    def __init__(self, maxsize):
+        self.dic = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns None if key isn't cached"""
+        value = self.dic.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.dic.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.dic[key] = value
+        self.dic.move_to_end(key)
+        if len(self.dic) > self.maxsize:
+            self.dic.popitem(last=False)
+
+    def clear(self):
+        self.dic.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hitRate(self):
+        total = self.hits + self.misses
+        return 100 * self.hits / total if total > 0 else 0
+
+    def __repr__(self):
+        return f'{self.hits=} {self.misses=} size={len(self.dic)}/{self.maxsize} hitRate={self.hitRate()}%'
+
+
 #
 # Damage calculation
 #
@@ -397,6 +475,93 @@ def calc_damage(attack: Move, attacker, defender, atkMod, defMod, rangeNum, crit
     return max(damage, 1)
 
 
+def calc_damage_batch(attack: Move, attacker, defender, atkStages=0, defStages=0, extraMultipliers=1):
+    """Vectorized calc_damage over every roll, without and with crit : damages[..., crit, rangeNum - MIN_RANGE].
+    atkStages is the attacker's attack (or special attack) stage and defStages the defender's defense (or special
+    defense) stage, depending on the move type. They are broadcast with extraMultipliers to give the leading axes."""
+    if np is None:
+        raise ImportError('calc_damage_batch needs numpy')
+
+    atkStages, defStages, extraMultipliers = np.broadcast_arrays(np.asarray(atkStages, dtype=np.int64),
+                                                                 np.asarray(defStages, dtype=np.int64),
+                                                                 np.asarray(extraMultipliers, dtype=np.int64))
+    multipliers = np.array(StatModifier.multipliers, dtype=np.int64)
+    divisors = np.array(StatModifier.divisors, dtype=np.int64)
+
+    # stat modifiers, see StatModifier.modAtk and co.
+    if attack.type.isPhysical():
+        atk_orig, def_orig = attacker.atk, defender.deff
+        atk_badge, def_badge = attacker.atkBadge, defender.defBadge
+    else:
+        atk_orig, def_orig = attacker.spcAtk, defender.spcDef
+        atk_badge = attacker.spcBadge
+        def_badge = defender.spcBadge and (defender.spcAtk in range(206, 433) or defender.spcAtk >= 661)
+    mod_atk = np.maximum(atk_orig * multipliers[atkStages + 6] // divisors[atkStages + 6], 1)
+    if atk_badge:
+        mod_atk = 9 * mod_atk // 8
+    mod_def = np.maximum(def_orig * multipliers[defStages + 6] // divisors[defStages + 6], 1)
+    if def_badge:
+        mod_def = 9 * mod_def // 8
+
+    STAB = attack.type != Type.NONE and (attack.type == attacker.species.type1 or attack.type == attacker.species.type2)
+
+    # Last axis : crit
+    crit = np.array([False, True])
+    applyModifiers = ~crit | (defStages < atkStages)[..., None]
+    effective_atk = np.where(applyModifiers, mod_atk[..., None], atk_orig)
+    effective_def = np.where(applyModifiers, mod_def[..., None], def_orig)
+
+    too_high = (effective_atk > 255) | (effective_def > 255)
+    effective_atk = np.where(too_high, np.maximum(1, effective_atk // 4), effective_atk)
+    effective_def = np.where(too_high, np.maximum(1, effective_def // 4), effective_def)
+
+    damage = (attacker.level * 2 // 5 + 2) * attack.power * effective_atk
+    damage //= effective_def
+    damage //= 50
+    damage = np.where(crit, damage * 2, damage)
+    damage = np.minimum(damage, 997) + 2
+
+    # Type boosts
+    if attacker.isTypeBoosted(attack.type):
+        damage += np.maximum(damage // 8, 1)
+
+    # STAB
+    if STAB:
+        damage = damage * 3 // 2
+
+    # Skipped effectiveness
+    damage *= extraMultipliers[..., None]
+
+    # Last axis : roll
+    damage = damage[..., None] * np.arange(MIN_RANGE, MAX_RANGE + 1, dtype=np.int64) // 255
+    return np.maximum(damage, 1)
+
+
+def checkBatchDamageParity(attack: Move, attacker, defender, extraMultipliers=range(1, 9)):
+    """Compares calc_damage_batch to calc_damage for every stage and multiplier"""
+    if np is None:
+        raise ImportError('checkBatchDamageParity needs numpy')
+    stages = np.arange(-6, 7)
+    extraMultipliers = np.array(extraMultipliers)
+    batch = calc_damage_batch(attack, attacker, defender,
+                              stages[:, None, None], stages[None, :, None], extraMultipliers[None, None, :])
+
+    for i, atkStage in enumerate(stages):
+        for j, defStage in enumerate(stages):
+            if attack.type.isPhysical():
+                atkMod, defMod = StatModifier(atk=int(atkStage)), StatModifier(deff=int(defStage))
+            else:
+                atkMod = StatModifier(spcAtk=int(atkStage))
+                defMod = StatModifier(spcAtk=int(defStage), spcDef=int(defStage))
+            for k, extraMultiplier in enumerate(extraMultipliers):
+                for c, crit in enumerate([False, True]):
+                    for r in range(MIN_RANGE, MAX_RANGE + 1):
+                        expected = calc_damage(attack, attacker, defender, atkMod, defMod, r, crit, int(extraMultiplier))
+                        if batch[i, j, k, c, r - MIN_RANGE] != expected:
+                            raise ValueError(f'calc_damage_batch differs from calc_damage for {attack} {atkStage=} '
+                                             f'{defStage=} {extraMultiplier=} {crit=} rangeNum={r}')
+
+
 class DamageDic:
     def __init__(self):
         self.dic = {}
@@ -411,22 +576,38 @@ class DamageDic:
         return repr(self.dic)
 
 
-def allNormalDamage(move, attacker, defender, attackerMod, defenderMod, extraMultiplier=1):
+damage_cache = LRUCache(4096)  # maxsize=0 disables it
+
+
+def allDamage(move, attacker, defender, attackerMod, defenderMod, crit, extraMultiplier):
+    """Every damage value over all rolls, with the number of rolls dealing it.
+    Cached on everything calc_damage reads : the returned DamageDic can't be modified."""
+    key = (move.index, crit, extraMultiplier, attacker.isTypeBoosted(move.type),
+           attacker.species.type1, attacker.species.type2, attacker.level, attacker.atk, attacker.spcAtk,
+           attacker.atkBadge, attacker.spcBadge, attackerMod.atk, attackerMod.spcAtk,
+           defender.deff, defender.spcDef, defender.spcAtk, defender.defBadge, defender.spcBadge,
+           defenderMod.deff, defenderMod.spcDef)
+    dmgDic = damage_cache.get(key)
+    if dmgDic is not None:
+        return dmgDic
+
     dmgDic = DamageDic()
     for r in range(MIN_RANGE, MAX_RANGE + 1):
-        dmg = calc_damage(move, attacker, defender, attackerMod, defenderMod, r, crit=False,
+        dmg = calc_damage(move, attacker, defender, attackerMod, defenderMod, r, crit=crit,
                           extra_multiplier=extraMultiplier)
         dmgDic.add(dmg)
+    dmgDic.dic = MappingProxyType(dmgDic.dic)
+
+    damage_cache.put(key, dmgDic)
     return dmgDic
 
 
+def allNormalDamage(move, attacker, defender, attackerMod, defenderMod, extraMultiplier=1):
+    return allDamage(move, attacker, defender, attackerMod, defenderMod, False, extraMultiplier)
+
+
 def allCritDamage(move, attacker, defender, attackerMod, defenderMod, extraMultiplier=1):
-    dmgDic = DamageDic()
-    for r in range(MIN_RANGE, MAX_RANGE + 1):
-        dmg = calc_damage(move, attacker, defender, attackerMod, defenderMod, r, crit=True,
-                          extra_multiplier=extraMultiplier)
-        dmgDic.add(dmg)
-    return dmgDic
+    return allDamage(move, attacker, defender, attackerMod, defenderMod, True, extraMultiplier)
 
 
 #
@@ -564,33 +745,46 @@ def ai_risky(moves, playerMod: StatModifier, enemyMod: StatModifier, player: Pok
     return scoring
 
 
+def merge_scorings(scorings: list[Scoring]):
+    """Keeps one Scoring per distinct score vector, adding up the odds of the identical ones"""
+    merged: dict[tuple, Scoring] = {}
+    for sc in scorings:
+        key = tuple(sc.scores)
+        if key in merged:
+            merged[key].odds += sc.odds
+        else:
+            merged[key] = sc
+    return list(merged.values())
+
+
 def perform_ai_turn(moves, playerMod, enemyMod, player, enemy):
     scoring = Scoring(len(moves))
     scorings: list[Scoring] = [scoring]
 
     # AI_SETUP
     scorings = ai_setup(moves, playerMod, enemyMod, scoring)
+    scorings = merge_scorings(scorings)
 
     # AI_SMART_FURYCUTTER
     tmp_scorings = []
     for sc in scorings:
         tmp_scs = ai_smart_furycutter(moves, enemyMod, enemy, sc)
         tmp_scorings.extend(tmp_scs)
-    scorings = tmp_scorings
+    scorings = merge_scorings(tmp_scorings)
 
     # AI_AGGRESSIVE
     tmp_scorings = []
     for sc in scorings:
         tmp_sc = ai_aggressive(moves, playerMod, enemyMod, player, enemy, sc)
         tmp_scorings.append(tmp_sc)
-    scorings = tmp_scorings
+    scorings = merge_scorings(tmp_scorings)
 
     # AI_RISKY
     tmp_scorings = []
     for sc in scorings:
         tmp_sc = ai_risky(moves, playerMod, enemyMod, player, enemy, sc)
         tmp_scorings.append(tmp_sc)
-    scorings = tmp_scorings
+    scorings = merge_scorings(tmp_scorings)
 
     return scorings
 
@@ -598,7 +792,18 @@ def perform_ai_turn(moves, playerMod, enemyMod, player, enemy):
 #
 # Odds
 #
+def mixedOddsError(odds, other):
+    """Error for an operation between odds of two backends, whose result would silently be wrong"""
+    return TypeError(f'{type(odds).__name__} and {type(other).__name__} are odds of different backends, see convertOdds')
+
+
 class Odds:
+    """Exact odds, always simplified. Odds(numerator, denominator) creates odds of the odds_backend type."""
+    def __new__(cls, *args):
+        if args and odds_backend != OddsBackend.EXACT:  # unpickling passes no args : checkpoints stay exact
+            return ODDS_BACKEND_CLASSES[odds_backend](*args)
+        return super().__new__(cls)
+
     def __init__(self, numerator: int, denominator: int):
         self.numerator = numerator
         self.denominator = denominator
@@ -619,6 +824,8 @@ class Odds:
         return self
 
     def in_place_add(self, other):  # Useful for in-place tuple modifications
+        if type(other) is not Odds:
+            raise mixedOddsError(self, other)
         if self.numerator == 0 and other.numerator == 0:
             self.numerator = 0
             self.denominator = 1
@@ -637,7 +844,9 @@ class Odds:
         return self
 
     def opposite(self):
-        return Odds(-self.numerator, self.denominator)
+        new = self.__copy__()
+        new.numerator = -new.numerator
+        return new
 
     def __mul__(self, other):  # Creates a new object
         new = self.__copy__()
@@ -649,6 +858,8 @@ class Odds:
         return self
 
     def in_place_mult(self, other):  # Useful for in-place tuple modifications
+        if type(other) is not Odds:
+            raise mixedOddsError(self, other)
         if self.numerator == 0 or other.numerator == 0:
             self.numerator = 0
             self.denominator = 1
@@ -661,7 +872,9 @@ class Odds:
         return (self - other).numerator < 0
 
     def __copy__(self):
-        new = Odds(self.numerator, self.denominator)
+        new = super().__new__(Odds)  # stays exact whatever the backend
+        new.numerator = self.numerator
+        new.denominator = self.denominator
         return new
 
     def __repr__(self):
@@ -671,6 +884,178 @@ class Odds:
         return self.numerator*100/self.denominator
 
 
+class FixedOdds:
+    """Odds stored as a numerator over 2**BITS, without any gcd. Products are rounded down to a multiple of 2**-BITS."""
+    BITS = 128
+    denominator = 1 << BITS
+
+    def __init__(self, numerator: int, denominator: int):
+        self.numerator = (numerator << FixedOdds.BITS) // denominator
+
+    def __add__(self, other):  # Creates a new object
+        new = self.__copy__()
+        new += other
+        return new
+
+    def __iadd__(self, other):  # Doesn't create an object
+        self.in_place_add(other)
+        return self
+
+    def in_place_add(self, other):
+        if type(other) is not FixedOdds:
+            raise mixedOddsError(self, other)
+        self.numerator += other.numerator
+
+    def __sub__(self, other):  # Creates a new object
+        new = self.__copy__()
+        new -= other
+        return new
+
+    def __isub__(self, other):  # Doesn't create an object
+        self.in_place_add(other.opposite())
+        return self
+
+    def opposite(self):
+        new = self.__copy__()
+        new.numerator = -new.numerator
+        return new
+
+    def __mul__(self, other):  # Creates a new object
+        new = self.__copy__()
+        new *= other
+        return new
+
+    def __imul__(self, other):  # Doesn't create an object
+        self.in_place_mult(other)
+        return self
+
+    def in_place_mult(self, other):
+        if type(other) is not FixedOdds:
+            raise mixedOddsError(self, other)
+        self.numerator = self.numerator * other.numerator >> FixedOdds.BITS
+
+    def __lt__(self, other):
+        return self.numerator < other.numerator
+
+    def __copy__(self):
+        new = FixedOdds.__new__(FixedOdds)
+        new.numerator = self.numerator
+        return new
+
+    def __repr__(self):
+        return f'({self.numerator}/2**{FixedOdds.BITS}={self.percentage()}%)'
+
+    def percentage(self):
+        return self.numerator*100/self.denominator
+
+
+class FloatOdds:
+    """Odds stored as a float64. Sums are compensated (Neumaier) so rounding errors don't pile up."""
+    denominator = 1
+
+    def __init__(self, numerator, denominator):
+        self.value = numerator / denominator
+        self.compensation = 0.0
+
+    @property
+    def numerator(self):
+        return self.value + self.compensation
+
+    def __add__(self, other):  # Creates a new object
+        new = self.__copy__()
+        new += other
+        return new
+
+    def __iadd__(self, other):  # Doesn't create an object
+        self.in_place_add(other)
+        return self
+
+    def in_place_add(self, other):
+        if type(other) is not FloatOdds:
+            raise mixedOddsError(self, other)
+        total = self.value + other.value
+        if abs(self.value) >= abs(other.value):
+            self.compensation += (self.value - total) + other.value
+        else:
+            self.compensation += (other.value - total) + self.value
+        self.compensation += other.compensation
+        self.value = total
+
+    def __sub__(self, other):  # Creates a new object
+        new = self.__copy__()
+        new -= other
+        return new
+
+    def __isub__(self, other):  # Doesn't create an object
+        self.in_place_add(other.opposite())
+        return self
+
+    def opposite(self):
+        new = self.__copy__()
+        new.value = -new.value
+        new.compensation = -new.compensation
+        return new
+
+    def __mul__(self, other):  # Creates a new object
+        new = self.__copy__()
+        new *= other
+        return new
+
+    def __imul__(self, other):  # Doesn't create an object
+        self.in_place_mult(other)
+        return self
+
+    def in_place_mult(self, other):
+        if type(other) is not FloatOdds:
+            raise mixedOddsError(self, other)
+        self.value = self.numerator * other.numerator
+        self.compensation = 0.0
+
+    def __lt__(self, other):
+        return self.numerator < other.numerator
+
+    def __copy__(self):
+        new = FloatOdds.__new__(FloatOdds)
+        new.value = self.value
+        new.compensation = self.compensation
+        return new
+
+    def __repr__(self):
+        return f'({self.numerator}={self.percentage()}%)'
+
+    def percentage(self):
+        return self.numerator*100
+
+
+class OddsBackend(Enum):
+    EXACT = 0  # Odds : for published numbers
+    FIXED = 1  # FixedOdds
+    FLOAT = 2  # FloatOdds : for large sweeps
+
+
+ODDS_BACKEND_CLASSES = {OddsBackend.EXACT: Odds, OddsBackend.FIXED: FixedOdds, OddsBackend.FLOAT: FloatOdds}
+
+
+def setOddsBackend(backend: OddsBackend):
+    global odds_backend
+    odds_backend = backend
+    ai_cache.clear()  # both hold odds of the previous backend
+    scenario_memo.clear()
+
+
+def oddsFraction(odds):
+    """Exact value of odds of any backend"""
+    return Fraction(odds.numerator) / odds.denominator
+
+
+def convertOdds(odds):
+    """Same odds, in the odds_backend type"""
+    if isinstance(odds, ODDS_BACKEND_CLASSES[odds_backend]):
+        return odds
+    fraction = oddsFraction(odds)
+    return Odds(fraction.numerator, fraction.denominator)
+
+
 def extract_move_odds(scorings: list[Scoring]):
     odds_list: list[Odds] = []
     for _ in scorings[0].scores:
@@ -686,6 +1071,26 @@ def extract_move_odds(scorings: list[Scoring]):
     return odds_list
 
 
+ai_cache = LRUCache(4096)  # maxsize=0 disables it
+
+
+def enemyMoveOdds(moves, playerMod: StatModifier, enemyMod: StatModifier, player: Pokemon, enemy: Pokemon):
+    """Odds for the enemy to choose each move : perform_ai_turn + extract_move_odds, cached on what the AI layers read"""
+    # Max roll damages, as computed by ai_aggressive and ai_risky
+    maxDamages = tuple(max(allNormalDamage(move, enemy, player, enemyMod, playerMod).dic) for move in moves)
+    key = (tuple(move.index for move in moves), enemyMod.turn == 1, playerMod.turn == 1, enemyMod.furycutterNb,
+           100 * enemy.currHP / enemy.hp <= 25, maxDamages, player.currHP)
+    move_odds = ai_cache.get(key)
+    if move_odds is not None:
+        return move_odds
+
+    ai_scorings = perform_ai_turn(moves, playerMod, enemyMod, player, enemy)
+    move_odds = tuple(extract_move_odds(ai_scorings))  # shared : must not be modified
+
+    ai_cache.put(key, move_odds)
+    return move_odds
+
+
 #
 # Battle logic
 #
@@ -696,6 +1101,7 @@ class WhoFights(Enum):
 
 class TurnActions:
     MAX_BAD_OUTCOME = 0
+    DISALLOWED_CRIT = -(1 << 20)  # remainingBadOutcomes of the crits that allow_crits_* disables, with prune_epsilon
     def __init__(self, name: str, player: Pokemon, enemy: Pokemon, playerMod: StatModifier, enemyMod: StatModifier, odds: Odds,
                  hasPlayerPlayed=True, hasEnemyPlayed=True, whoFightsNext=WhoFights.PLAYER,
                  wasPoisonApplied=True, wasJustPoisoned=False):
@@ -713,7 +1119,14 @@ class TurnActions:
         self.remainingBadOutcomes = TurnActions.MAX_BAD_OUTCOME
 
     def __copy__(self):
-        return copy.deepcopy(self)
+        copyy = TurnActions.__new__(TurnActions)
+        copyy.__dict__.update(self.__dict__)
+        copyy.player = self.player.__copy__()
+        copyy.enemy = self.enemy.__copy__()
+        copyy.playerMod = self.playerMod.__copy__()
+        copyy.enemyMod = self.enemyMod.__copy__()
+        copyy.odds = self.odds.__copy__()
+        return copyy
 
     def __repr__(self):
         return f'{self.player.currHP=} {self.player.isPoisoned=} {self.playerMod=} {self.odds =} {self.name} '
@@ -739,11 +1152,90 @@ class TurnActions:
     def __eq__(self, other):
         return hash(self) == hash(other)
 
+    # Bits used by each field of stateKey, from the least significant one
+    HP_BITS = 20  # HP can go very negative on the last hit
+    STAGE_BITS = 4  # 0-12
+    RAGE_BITS = 4  # 1-8
+    FURYCUTTER_BITS = 3  # 0-5
+    TURN_BITS = 6
+
+    def stateKey(self):
+        """Packs every field that changes during a fight into a single int (like __hash__ does for the player only).
+        Pokémon stats, moves and badges are not included : see staticKey."""
+        key = self.remainingBadOutcomes + 1  # most significant field, unbounded
+
+        for mod in (self.playerMod, self.enemyMod):
+            for stage in (mod.atk, mod.deff, mod.spd, mod.spcAtk, mod.spcDef):
+                key <<= TurnActions.STAGE_BITS
+                key += stage + 6
+            key <<= TurnActions.RAGE_BITS
+            key += mod.rageNb
+            key <<= TurnActions.FURYCUTTER_BITS
+            key += mod.furycutterNb
+            key <<= TurnActions.TURN_BITS
+            key += mod.turn
+
+        for pokemon in (self.player, self.enemy):
+            key <<= TurnActions.HP_BITS
+            key += pokemon.currHP + (1 << (TurnActions.HP_BITS - 1))
+            key <<= 1
+            key += 1 if pokemon.isPoisoned else 0
+
+        for flag in (self.hasPlayerPlayed, self.hasEnemyPlayed, self.whoFightsNext == WhoFights.ENEMY,
+                     self.wasPoisonApplied, self.wasJustPoisoned):
+            key <<= 1
+            key += 1 if flag else 0
+
+        return key
+
+    @staticmethod
+    def fromStateKey(key: int, player: Pokemon, enemy: Pokemon, odds: Odds, name=''):
+        """Inverse of stateKey : a turn between copies of player and enemy, with the fields packed in key"""
+        t = TurnActions(name, player.__copy__(), enemy.__copy__(), StatModifier(), StatModifier(), odds)
+
+        t.wasJustPoisoned, t.wasPoisonApplied, whoFightsNext, t.hasEnemyPlayed, t.hasPlayerPlayed = \
+            (bool(key >> shift & 1) for shift in range(5))
+        t.whoFightsNext = WhoFights.ENEMY if whoFightsNext else WhoFights.PLAYER
+        key >>= 5
+
+        for pokemon in (t.enemy, t.player):
+            pokemon.isPoisoned = bool(key & 1)
+            key >>= 1
+            pokemon.currHP = (key & ((1 << TurnActions.HP_BITS) - 1)) - (1 << (TurnActions.HP_BITS - 1))
+            key >>= TurnActions.HP_BITS
+
+        for mod in (t.enemyMod, t.playerMod):
+            mod.turn = key & ((1 << TurnActions.TURN_BITS) - 1)
+            key >>= TurnActions.TURN_BITS
+            mod.furycutterNb = key & ((1 << TurnActions.FURYCUTTER_BITS) - 1)
+            key >>= TurnActions.FURYCUTTER_BITS
+            mod.rageNb = key & ((1 << TurnActions.RAGE_BITS) - 1)
+            key >>= TurnActions.RAGE_BITS
+            stages = []
+            for _ in range(5):
+                stages.append((key & ((1 << TurnActions.STAGE_BITS) - 1)) - 6)
+                key >>= TurnActions.STAGE_BITS
+            mod.spcDef, mod.spcAtk, mod.spd, mod.deff, mod.atk = stages
+
+        t.remainingBadOutcomes = key - 1
+        return t
+
+    def staticKey(self):
+        """Everything about both Pokémon that stays the same during a fight, badges included"""
+        return (self.player.species.dex, self.player.level, self.player.hp, self.player.atk, self.player.deff,
+                self.player.spd, self.player.spcAtk, self.player.spcDef, tuple(move.index for move in self.player.moves),
+                self.player.atkBadge, self.player.defBadge, self.player.spdBadge, self.player.spcBadge,
+                self.enemy.species.dex, self.enemy.level, self.enemy.hp, self.enemy.atk, self.enemy.deff,
+                self.enemy.spd, self.enemy.spcAtk, self.enemy.spcDef, tuple(move.index for move in self.enemy.moves),
+                self.enemy.atkBadge, self.enemy.defBadge, self.enemy.spdBadge, self.enemy.spcBadge,
+                tuple(elementalBadgeBoosts))  # isTypeBoosted reads the global ones
+
 
 class FightOutcome(Enum):
     STILL_GOING = 0
     PLAYER_IS_KO = 1
     ENEMY_IS_KO = 2
+    PRUNED = 3  # only in OutcomesDic.total_odds : odds of the turns fightUntilKO didn't explore, see prune_epsilon
 
 
 #
@@ -755,9 +1247,16 @@ class OutcomesDic:
 
     def __init__(self):
         self.dic: dict[FightOutcome, dict[TurnActions, tuple[Odds, list[TurnActions]]]] \
-            = {FightOutcome.PLAYER_IS_KO: {}, FightOutcome.ENEMY_IS_KO: {}}
+            = {FightOutcome.PLAYER_IS_KO: {}, FightOutcome.ENEMY_IS_KO: {}, FightOutcome.PRUNED: {}}
         self.total_odds: dict[FightOutcome, Odds] \
-            = {FightOutcome.PLAYER_IS_KO: Odds(0, 1), FightOutcome.ENEMY_IS_KO: Odds(0, 1)}
+            = {FightOutcome.PLAYER_IS_KO: Odds(0, 1), FightOutcome.ENEMY_IS_KO: Odds(0, 1),
+               FightOutcome.PRUNED: Odds(0, 1)}
+
+    def __setstate__(self, state):
+        """Pickles made before FightOutcome.PRUNED existed have no PRUNED odds"""
+        self.__dict__.update(state)
+        self.dic.setdefault(FightOutcome.PRUNED, {})
+        self.total_odds.setdefault(FightOutcome.PRUNED, Odds(0, 1))
 
     def __getitem__(self, item):
         return self.dic[item]
@@ -775,11 +1274,62 @@ class OutcomesDic:
 
         self.total_odds[outcome].in_place_add(t.odds)
 
+    def prune(self, t: TurnActions):
+        """Counts the odds of t, which won't be explored, in PRUNED. The turn itself isn't stored."""
+        self.total_odds[FightOutcome.PRUNED].in_place_add(t.odds)
+
+    def bounds(self, outcome: FightOutcome):
+        """Lowest and highest odds of outcome : the PRUNED odds may all end with it"""
+        odds = oddsFraction(self.total_odds[outcome])
+        return odds, odds + oddsFraction(self.total_odds[FightOutcome.PRUNED])
+
+    def toOddsBackend(self):
+        """Converts all the odds, scenarios included, to the odds_backend type. Loaded checkpoints are exact."""
+        for outcome in self.dic:
+            for t, (odds, turns) in self[outcome].items():
+                t.odds = convertOdds(odds)
+                self[outcome][t] = (t.odds, turns)
+        for outcome, odds in self.total_odds.items():
+            self.total_odds[outcome] = convertOdds(odds)
+        return self
+
+    def totalFraction(self):
+        """Exact sum of the odds of every outcome, PRUNED included"""
+        return sum((oddsFraction(odds) for odds in self.total_odds.values()), Fraction(0))
+
+    def merge(self, other: 'OutcomesDic'):
+        """Adds all of other's scenarios, with the same result as adding them one by one after self's"""
+        for outcome in [FightOutcome.PLAYER_IS_KO, FightOutcome.ENEMY_IS_KO]:
+            for t, (odds, turns) in other[outcome].items():
+                if t in self[outcome].keys():
+                    self[outcome][t][OutcomesDic.TOTAL_ODDS_IDX].in_place_add(odds)
+                    if store_all_scenarii:
+                        self[outcome][t][OutcomesDic.LIST_TURNS_IDX].extend(turns)
+                else:
+                    self[outcome][t] = (odds, turns)
+
+            self.total_odds[outcome].in_place_add(other.total_odds[outcome])
+        self.total_odds[FightOutcome.PRUNED].in_place_add(other.total_odds[FightOutcome.PRUNED])
+
+    def scaled(self, odds):
+        """Same scenarios, with every odds multiplied by odds"""
+        scaled = OutcomesDic()
+        for outcome in [FightOutcome.PLAYER_IS_KO, FightOutcome.ENEMY_IS_KO]:
+            for t, (entry_odds, turns) in self[outcome].items():
+                scaled[outcome][t] = (entry_odds * odds, list(turns))
+            scaled.total_odds[outcome] = self.total_odds[outcome] * odds
+        scaled.total_odds[FightOutcome.PRUNED] = self.total_odds[FightOutcome.PRUNED] * odds
+        return scaled
+
     def short_display(self):
         player_percent = self.total_odds[FightOutcome.PLAYER_IS_KO].percentage()
         enemy_percent = self.total_odds[FightOutcome.ENEMY_IS_KO].percentage()
         total_percent = player_percent + enemy_percent
-        return f'{FightOutcome.PLAYER_IS_KO.name}={player_percent}%, {FightOutcome.ENEMY_IS_KO.name}={enemy_percent}%, TOTAL={total_percent}%'
+        display = f'{FightOutcome.PLAYER_IS_KO.name}={player_percent}%, {FightOutcome.ENEMY_IS_KO.name}={enemy_percent}%, TOTAL={total_percent}%'
+        if self.total_odds[FightOutcome.PRUNED].numerator != 0:
+            pruned_percent = self.total_odds[FightOutcome.PRUNED].percentage()
+            display += f', {FightOutcome.PRUNED.name}={pruned_percent}%, TOTAL+PRUNED={total_percent + pruned_percent}%'
+        return display
 
     def full_display(self):
         return repr(self.dic) + self.short_display()
@@ -791,8 +1341,9 @@ class OutcomesDic:
         return 100 * player_percent / total_percent
 
 
-def doPlayerTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: OutcomesDic):
-    for is_crit in [False, True] if allow_crits_for_player else [False]:
+def doPlayerTurn(t: TurnActions):
+    """Yields every turn following the player's Rage"""
+    for is_crit in [False, True] if allow_crits_for_player or prune_epsilon is not None else [False]:
         damages = allNormalDamage(RAGE, t.player, t.enemy, t.playerMod, t.enemyMod, extraMultiplier=t.playerMod.rageNb) \
                   if not is_crit \
                   else allCritDamage(RAGE, t.player, t.enemy, t.playerMod, t.enemyMod, extraMultiplier=t.playerMod.rageNb)
@@ -805,20 +1356,22 @@ def doPlayerTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcome
             next_turn.odds *= Odds(roll, 39)  # roll odds
 
             next_turn.enemy.currHP -= dmg
+            if is_crit and not allow_crits_for_player:
+                next_turn.remainingBadOutcomes = TurnActions.DISALLOWED_CRIT  # counted in PRUNED by fightUntilKO
 
             next_turn.hasPlayerPlayed = True
             next_turn.whoFightsNext = WhoFights.ENEMY
-            fightUntilKO(next_turn, initial_turn, outcomesDic)
+            yield next_turn
 
 
 def enemyMultiplier(move: Move, enemyMod: StatModifier):
     return 1 << enemyMod.furycutterNb if move.name == FURY_CUTTER.name else 1
 
 
-def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: OutcomesDic):
+def doEnemyTurn(t: TurnActions):
+    """Yields every turn following the enemy's move, AI choice included"""
     # AI
-    ai_scorings = perform_ai_turn(t.enemy.moves, t.playerMod, t.enemyMod, t.player, t.enemy)
-    move_odds = extract_move_odds(ai_scorings)
+    move_odds = enemyMoveOdds(t.enemy.moves, t.playerMod, t.enemyMod, t.player, t.enemy)
 
     for idx, oddsToChooseMove in enumerate(move_odds):
         move = t.enemy.moves[idx]
@@ -831,7 +1384,7 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
         tmp_turn_after_move_choice.odds *= oddsToChooseMove
         # Move deals damage
         if move.power >= 2:
-            for is_crit in [False, True] if allow_crits_for_player else [False]:
+            for is_crit in [False, True] if allow_crits_for_enemy or prune_epsilon is not None else [False]:
                 damages = allNormalDamage(move, t.enemy, t.player, t.enemyMod, t.playerMod,
                                                   extraMultiplier=enemyMultiplier(move, t.enemyMod)) \
                           if not is_crit \
@@ -847,6 +1400,8 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
                     next_turn.odds *= Odds(roll, 39)  # roll odds
 
                     next_turn.player.currHP -= dmg
+                    if is_crit and not allow_crits_for_enemy:
+                        next_turn.remainingBadOutcomes = TurnActions.DISALLOWED_CRIT  # counted in PRUNED by fightUntilKO
 
                     # Update Rage & Fury Cutter | TODO : proper handling of Rage's turn 1
                     next_turn.playerMod.rageNb = min(8, next_turn.playerMod.rageNb + 1)
@@ -861,7 +1416,7 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
                         next_turn_noPSN = next_turn.__copy__()
                         next_turn_noPSN.name += '|'
                         next_turn_noPSN.odds *= Odds(100 - move.effectChance, 100)
-                        fightUntilKO(next_turn_noPSN, initial_turn, outcomesDic)
+                        yield next_turn_noPSN
 
                         # poison
                         next_turn_PSN = next_turn.__copy__()
@@ -872,10 +1427,10 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
                         next_turn_PSN.player.isPoisoned = True
                         next_turn_PSN.wasJustPoisoned = True
 
-                        fightUntilKO(next_turn_PSN, initial_turn, outcomesDic)
+                        yield next_turn_PSN
                     else:
                         next_turn.name += '|'
-                        fightUntilKO(next_turn, initial_turn, outcomesDic)
+                        yield next_turn
 
             # Move can miss
             if move.accuracy < 100:
@@ -888,7 +1443,7 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
 
                 next_turn.hasEnemyPlayed = True
                 next_turn.whoFightsNext = WhoFights.PLAYER
-                fightUntilKO(next_turn, initial_turn, outcomesDic)
+                yield next_turn
 
         # Move deals no damage
         elif move.power == 0:
@@ -902,7 +1457,7 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
 
                 next_turn.hasEnemyPlayed = True
                 next_turn.whoFightsNext = WhoFights.PLAYER
-                fightUntilKO(next_turn, initial_turn, outcomesDic)
+                yield next_turn
             elif move.effect == MoveEffect.SPEED_DOWN or move.effect == MoveEffect.DEFENSE_DOWN:
                 # Move doesn't miss
                 next_turn = tmp_turn_after_move_choice.__copy__()
@@ -919,7 +1474,7 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
 
                 next_turn.hasEnemyPlayed = True
                 next_turn.whoFightsNext = WhoFights.PLAYER
-                fightUntilKO(next_turn, initial_turn, outcomesDic)
+                yield next_turn
                 # fallthrough
 
                 # Move can miss
@@ -934,7 +1489,80 @@ def doEnemyTurn(t: TurnActions, initial_turn: TurnActions, outcomesDic: Outcomes
 
                 next_turn.hasEnemyPlayed = True
                 next_turn.whoFightsNext = WhoFights.PLAYER
-                fightUntilKO(next_turn, initial_turn, outcomesDic)
+                yield next_turn
+
+
+def doEndOfTurn(previous_turn: TurnActions):
+    """Yields the turns following a turn where everyone has fought : poison tick, then who plays next"""
+    # Poison tick
+    if previous_turn.wasJustPoisoned:
+        # If player was just poisoned, don't apply poison tick
+        previous_turn.wasJustPoisoned = False
+    elif previous_turn.player.isPoisoned and not previous_turn.wasPoisonApplied:
+        next_turn = previous_turn.__copy__()
+
+        next_turn.name += f'playerpsn->{previous_turn.player.hp // 8}|'
+
+        next_turn.player.currHP -= previous_turn.player.hp // 8
+
+        next_turn.wasPoisonApplied = True
+        yield next_turn  # who plays next is explored from next_turn, once fightOutcome checked the poison KO
+        return
+
+    # Who plays next ?
+    next_turn = previous_turn.__copy__()
+    next_turn.name += '|'
+    next_turn.hasPlayerPlayed = False
+    next_turn.hasEnemyPlayed = False
+    next_turn.wasPoisonApplied = False
+    next_turn.playerMod.turn += 1
+    next_turn.enemyMod.turn += 1
+
+    playerSpd = previous_turn.playerMod.modSpd(previous_turn.player)
+    enemySpd = previous_turn.enemyMod.modSpd(previous_turn.enemy)
+    if playerSpd == enemySpd:
+        next_turn.odds *= Odds(1, 2)  # speed tie, for both orders
+    if playerSpd >= enemySpd:
+        next_turn.whoFightsNext = WhoFights.PLAYER
+        yield next_turn
+    if playerSpd <= enemySpd:
+        next_turn.whoFightsNext = WhoFights.ENEMY
+        yield next_turn
+
+
+def nextTurns(previous_turn: TurnActions):
+    """Yields every turn reachable from previous_turn, in the order fightUntilKO explores them.
+    Yielded turns may be reused by the next ones : consume each of them before resuming."""
+    # Check if everyone has fought during a turn
+    if previous_turn.hasPlayerPlayed and previous_turn.hasEnemyPlayed:
+        yield from doEndOfTurn(previous_turn)
+
+    # Not everyone has fought : perform next half-turn
+    if not previous_turn.hasPlayerPlayed and previous_turn.whoFightsNext == WhoFights.PLAYER:
+        yield from doPlayerTurn(previous_turn)
+
+    if not previous_turn.hasEnemyPlayed and previous_turn.whoFightsNext == WhoFights.ENEMY:
+        yield from doEnemyTurn(previous_turn)
+
+
+def fightOutcome(t: TurnActions):
+    """Returns None if t has too many bad outcomes to be explored, or is a disallowed crit.
+    With prune_epsilon, only the odds cut the fight : MAX_BAD_OUTCOME doesn't apply."""
+    # Check for too many bad outcomes
+    if t.remainingBadOutcomes <= TurnActions.DISALLOWED_CRIT or (t.remainingBadOutcomes < 0 and prune_epsilon is None):
+        return None
+
+    # Check if there are no Rage PP left
+    if t.playerMod.turn > 20:
+        return FightOutcome.PLAYER_IS_KO  # TODO : create another FightOutcome ?
+
+    # Check for KO
+    if t.enemy.currHP <= 0:
+        return FightOutcome.ENEMY_IS_KO
+    if t.player.currHP <= 0:
+        return FightOutcome.PLAYER_IS_KO
+
+    return FightOutcome.STILL_GOING
 
 
 def checkOddsValidity(final_turn: TurnActions, initial_turn: TurnActions):
@@ -942,77 +1570,1408 @@ def checkOddsValidity(final_turn: TurnActions, initial_turn: TurnActions):
         raise ValueError(f'Final odds are too high. Final:{final_turn}. Initial:{initial_turn}')
 
 
-def fightUntilKO(previous_turn: TurnActions, initial_turn: TurnActions, outcomesDic: OutcomesDic):
-    global total_entries
+def isBelowPruneEpsilon(odds):
+    """odds < prune_epsilon, for odds of any backend"""
+    return odds.numerator * prune_epsilon.denominator < prune_epsilon.numerator * odds.denominator
 
-    # Check for too many bad outcomes
-    if previous_turn.remainingBadOutcomes < 0:
+
+def fightUntilKO(previous_turn: TurnActions, initial_turn: TurnActions, outcomesDic: OutcomesDic):
+    """With prune_epsilon, the turns of lower odds and the disallowed crits are counted in PRUNED"""
+    outcome = fightOutcome(previous_turn)
+    if outcome is None:
+        if prune_epsilon is not None:
+            outcomesDic.prune(previous_turn)
         return
 
-    # Check if there are no Rage PP left
-    if previous_turn.playerMod.turn > 20:
+    if outcome != FightOutcome.STILL_GOING:
         # checkOddsValidity(previous_turn, initial_turn)
-        outcomesDic.add(FightOutcome.PLAYER_IS_KO, previous_turn)  # TODO : create another FightOutcome ?
-        total_entries += 1
-        print(total_entries) if total_entries % 10_000 == 0 else None
+        outcomesDic.add(outcome, previous_turn.__copy__())  # previous_turn may be reused by nextTurns
         return
 
-    # Check for KO
-    if previous_turn.enemy.currHP <= 0 or previous_turn.player.currHP <= 0:
-        if previous_turn.enemy.currHP <= 0:
-            outcome = FightOutcome.ENEMY_IS_KO
+    if prune_epsilon is not None and isBelowPruneEpsilon(previous_turn.odds):
+        outcomesDic.prune(previous_turn)
+        return
+
+    for next_turn in nextTurns(previous_turn):
+        fightUntilKO(next_turn, initial_turn, outcomesDic)
+
+
+#
+# Memoized engine
+#
+def outcomeDistribution(t: TurnActions, memo: dict):
+    """Final outcomes reachable from t, as {(FightOutcome, hash of the final turn): [odds from t, final turn]}.
+    Keys are ordered as fightUntilKO first reaches them, so the final turns are the ones it would store."""
+    key = t.stateKey()
+    if key in memo:
+        return memo[key]
+
+    turn = t.__copy__()
+    turn.odds = Odds(1, 1)
+
+    distribution = {}
+    for next_turn in nextTurns(turn):
+        outcome = fightOutcome(next_turn)
+        if outcome is None:
+            continue
+
+        if outcome == FightOutcome.STILL_GOING:
+            for final_key, (odds, final_turn) in outcomeDistribution(next_turn, memo).items():
+                odds = next_turn.odds * odds
+                if final_key in distribution:
+                    distribution[final_key][0] += odds
+                else:
+                    distribution[final_key] = [odds, final_turn]
         else:
-            outcome = FightOutcome.PLAYER_IS_KO
-        # checkOddsValidity(previous_turn, initial_turn)
-        outcomesDic.add(outcome, previous_turn)
-        total_entries += 1
-        print(total_entries) if total_entries % 10_000 == 0 else None
+            final_key = (outcome, hash(next_turn))
+            if final_key in distribution:
+                distribution[final_key][0] += next_turn.odds
+            else:
+                distribution[final_key] = [next_turn.odds.__copy__(), next_turn.__copy__()]
+
+    memo[key] = distribution
+    return distribution
+
+
+def fightUntilKOMemoized(starting_turn: TurnActions, outcomesDic: OutcomesDic, memo: dict = None):
+    """Same results as fightUntilKO, but each distinct battle state is only explored once.
+    memo can be shared between fights, even with different Pokémon stats or settings."""
+    if memo is None:
+        memo = {}
+    # The settings read by nextTurns and fightOutcome change the distributions as much as the stats
+    memo = memo.setdefault((starting_turn.staticKey(), allow_crits_for_player, allow_crits_for_enemy, prune_epsilon), {})
+
+    outcome = fightOutcome(starting_turn)
+    if outcome is None:
+        return
+    if outcome != FightOutcome.STILL_GOING:
+        outcomesDic.add(outcome, starting_turn)
         return
 
-    # Check if everyone has fought during a turn
-    if previous_turn.hasPlayerPlayed and previous_turn.hasEnemyPlayed:
-        # Poison tick
-        if previous_turn.wasJustPoisoned:
-            # If player was just poisoned, don't apply poison tick
-            previous_turn.wasJustPoisoned = False
-        elif previous_turn.player.isPoisoned and not previous_turn.wasPoisonApplied:
-            next_turn = previous_turn
+    for (outcome, _), (odds, final_turn) in outcomeDistribution(starting_turn, memo).items():
+        final_turn = final_turn.__copy__()
+        final_turn.odds = starting_turn.odds * odds
+        outcomesDic.add(outcome, final_turn)
 
-            next_turn.name += f'playerpsn->{previous_turn.player.hp // 8}|'
 
-            next_turn.player.currHP -= previous_turn.player.hp // 8
+#
+# Frontier engine
+#
+def fightUntilKOFrontier(starting_turn: TurnActions, outcomesDic: OutcomesDic):
+    """Same odds as fightUntilKO, but explores all the turns step by step, merging equal battle states.
+    The turn stored for each final state is the first one reached, not necessarily fightUntilKO's.
+    With prune_epsilon, a battle state is counted in PRUNED when the odds of all the turns merged into it are lower, so
+    it prunes less than fightUntilKO, which compares the odds of each turn."""
+    frontier: dict[int, TurnActions] = {starting_turn.stateKey(): starting_turn.__copy__()}
+    step = 0
+    while len(frontier) > 0:
+        next_frontier: dict[int, TurnActions] = {}
+        for previous_turn in frontier.values():
+            outcome = fightOutcome(previous_turn)
+            if outcome is None:
+                if prune_epsilon is not None:
+                    outcomesDic.prune(previous_turn)
+                continue
+            if outcome != FightOutcome.STILL_GOING:
+                outcomesDic.add(outcome, previous_turn)
+                continue
+            if prune_epsilon is not None and isBelowPruneEpsilon(previous_turn.odds):
+                outcomesDic.prune(previous_turn)
+                continue
+
+            for next_turn in nextTurns(previous_turn):
+                key = next_turn.stateKey()
+                if key in next_frontier:
+                    next_frontier[key].odds += next_turn.odds
+                else:
+                    next_frontier[key] = next_turn.__copy__()  # next_turn may be reused by nextTurns
+
+        step += 1
+        reportProgress(frontier_step=step, frontier=len(next_frontier))
+        frontier = next_frontier
 
-            next_turn.wasPoisonApplied = True
-            fightUntilKO(next_turn, initial_turn, outcomesDic)
 
-        # Who plays next ?
-        next_turn = previous_turn.__copy__()
-        next_turn.name += '|'
-        next_turn.hasPlayerPlayed = False
-        next_turn.hasEnemyPlayed = False
-        next_turn.wasPoisonApplied = False
-        next_turn.playerMod.turn += 1
-        next_turn.enemyMod.turn += 1
-
-        playerSpd = previous_turn.playerMod.modSpd(previous_turn.player)
-        enemySpd = previous_turn.enemyMod.modSpd(previous_turn.enemy)
-        if playerSpd >= enemySpd:
-            if playerSpd == enemySpd:
-                next_turn.odds *= Odds(1, 2)
-            next_turn.whoFightsNext = WhoFights.PLAYER
-            fightUntilKO(next_turn, initial_turn, outcomesDic)
-        if playerSpd <= enemySpd:
-            if playerSpd == enemySpd:
-                next_turn.odds *= Odds(1, 2)
-            next_turn.whoFightsNext = WhoFights.ENEMY
-            fightUntilKO(next_turn, initial_turn, outcomesDic)
+#
+# Parallel engine
+#
+def splitFight(previous_turn: TurnActions, depth: int, items: list):
+    """Explores the first depth steps of the fight like fightUntilKO, appending to items, in exploration order,
+    (outcome, final turn) for finished fights and (FightOutcome.STILL_GOING, turn) for the subtrees left to explore.
+    With prune_epsilon, the turns fightOutcome cuts are appended too, as (None, turn)."""
+    outcome = fightOutcome(previous_turn)
+    if outcome is None:
+        if prune_epsilon is not None:  # fightUntilKO counts it in PRUNED
+            items.append((outcome, previous_turn.__copy__()))
+        return
+    if outcome != FightOutcome.STILL_GOING or depth == 0:
+        items.append((outcome, previous_turn.__copy__()))  # previous_turn may be reused by nextTurns
+        return
 
-    # Not everyone has fought : perform next half-turn
-    if not previous_turn.hasPlayerPlayed and previous_turn.whoFightsNext == WhoFights.PLAYER:
-        doPlayerTurn(previous_turn, initial_turn, outcomesDic)  # Calls fightUntilKO
+    for next_turn in nextTurns(previous_turn):
+        splitFight(next_turn, depth - 1, items)
 
-    if not previous_turn.hasEnemyPlayed and previous_turn.whoFightsNext == WhoFights.ENEMY:
-        doEnemyTurn(previous_turn, initial_turn, outcomesDic)  # Calls fightUntilKO
+
+def fightTask(turn: TurnActions):
+    """Explores a subtree in a worker process, returns its OutcomesDic and how long it took"""
+    start = time.perf_counter()
+    outcomesDic = OutcomesDic()
+    fightUntilKOMemoized(turn, outcomesDic, scenario_memo)
+    return outcomesDic, time.perf_counter() - start
+
+
+def fightUntilKOParallel(starting_turn: TurnActions, outcomesDic: OutcomesDic, depth: int = None, workers: int = None):
+    """Same results as fightUntilKO : the fight is cut into subtrees after depth steps, which idle worker processes
+    take one at a time from a shared queue, so a few huge subtrees don't leave the other workers waiting.
+    Returns the (turn name, seconds) of every subtree."""
+    depth = parallel_split_depth if depth is None else depth
+    workers = fight_workers if workers is None else workers
+
+    items = []
+    splitFight(starting_turn, depth, items)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(workerTask, fightTask, turn) if outcome == FightOutcome.STILL_GOING else None
+                   for outcome, turn in items]
+
+        # Merging in exploration order gives the same OutcomesDic as fightUntilKO
+        timings = []
+        for (outcome, turn), future in zip(items, futures):
+            if future is None:
+                outcomesDic.add(outcome, turn)
+            else:
+                taskOutcomesDic, seconds = workerResult(future.result())
+                outcomesDic.merge(taskOutcomesDic)
+                timings.append((turn.name, seconds))
+
+    total = sum(seconds for _, seconds in timings)
+    longest = max((seconds for _, seconds in timings), default=0)
+    reportProgress(subtrees=len(timings), subtrees_seconds=round(total, 3), longest_subtree_seconds=round(longest, 3),
+                   fight_workers=workers)
+    return timings
+
+
+class Engine(Enum):
+    RECURSIVE = 0
+    MEMOIZED = 1
+    FRONTIER = 2
+    PARALLEL = 3
+
+
+PRUNING_ENGINES = (Engine.FRONTIER, Engine.RECURSIVE)  # the engines exploring with absolute odds, for prune_epsilon
+
+
+def runFight(starting_turn: TurnActions, outcomesDic: OutcomesDic, memo: dict = None):
+    if prune_epsilon is not None and engine not in PRUNING_ENGINES:  # the other engines explore with relative odds
+        raise ValueError(f'prune_epsilon needs one of {PRUNING_ENGINES}, not {engine}')
+    starting_turn.odds = convertOdds(starting_turn.odds)
+    checked = prune_epsilon is not None and odds_backend == OddsBackend.EXACT  # inexact backends round the odds
+    total_before = outcomesDic.totalFraction() if checked else None
+    if engine == Engine.MEMOIZED:
+        fightUntilKOMemoized(starting_turn, outcomesDic, memo)
+    elif engine == Engine.FRONTIER:
+        fightUntilKOFrontier(starting_turn, outcomesDic)
+    elif engine == Engine.PARALLEL:
+        fightUntilKOParallel(starting_turn, outcomesDic)
+    else:
+        fightUntilKO(starting_turn, starting_turn, outcomesDic)
+
+    # With pruning, all the odds of the fight land in exactly one outcome
+    added = outcomesDic.totalFraction() - total_before if checked else None
+    if checked and added != oddsFraction(starting_turn.odds):
+        raise ValueError(f'Outcomes add up to {added} instead of {oddsFraction(starting_turn.odds)} : '
+                         f'{outcomesDic.short_display()}. Starting turn:{starting_turn}')
+
+
+def crossCheckOddsBackends(starting_turn: TurnActions):
+    """Runs the fight with every odds backend and returns, for each of them, the maximum deviation from the exact
+    odds, over the total odds and the odds of every final state"""
+    previous_backend = odds_backend
+    results = {}
+    for backend in OddsBackend:
+        setOddsBackend(backend)
+        outcomesDic = OutcomesDic()
+        runFight(starting_turn.__copy__(), outcomesDic, {})
+        results[backend] = {outcome: oddsFraction(odds) for outcome, odds in outcomesDic.total_odds.items()}
+        for outcome in outcomesDic.total_odds.keys():
+            for t, tuplee in outcomesDic[outcome].items():
+                results[backend][(outcome, hash(t))] = oddsFraction(tuplee[OutcomesDic.TOTAL_ODDS_IDX])
+    setOddsBackend(previous_backend)
+
+    exact = results[OddsBackend.EXACT]
+    deviations = {}
+    for backend, values in results.items():
+        if values.keys() != exact.keys():
+            raise ValueError(f'{backend} reaches different final states than {OddsBackend.EXACT}')
+        deviations[backend] = float(max(abs(value - exact[key]) for key, value in values.items()))
+        print(f'{backend.name}: max deviation={deviations[backend]}')
+    return deviations
+
+
+#
+# Anytime engine
+#
+def fightUntilKOAnytime(turns: list[TurnActions], outcomesDic: OutcomesDic, node_budget=None, seconds=None,
+                        target_width=None, check_every=1000):
+    """Explores the most probable turns first, until node_budget turns are explored, seconds are elapsed or the bounds
+    of OutcomesDic.bounds are at most target_width wide. The turns left to explore are then counted in PRUNED, like the
+    ones fightOutcome cuts and the odds nextTurns doesn't yield (disabled crits). With no budget, same total odds as
+    fightUntilKO. Raises if the outcomes, PRUNED included, don't add up to the odds of turns, which inexact backends
+    only round. Returns the number of explored turns."""
+    start = time.perf_counter()
+    total_before = outcomesDic.totalFraction()
+    pruned_before = oddsFraction(outcomesDic.total_odds[FightOutcome.PRUNED])
+    heap = []  # (-odds, pushed, turn) : pushed keeps equal odds in exploration order, without comparing turns
+    pushed = 0
+    unexplored = Odds(0, 1)  # odds of the turns in heap
+    explored = 0
+
+    next_turns = []
+    for turn in turns:
+        next_turns.append(turn.__copy__())
+        next_turns[-1].odds = convertOdds(turn.odds)
+    starting_odds = sum((oddsFraction(turn.odds) for turn in next_turns), Fraction(0))
+    turn = None  # the turn next_turns follow, None for the starting turns
+    while True:
+        reached = Odds(0, 1)
+        for next_turn in next_turns:
+            reached += next_turn.odds
+            outcome = fightOutcome(next_turn)
+            if outcome is None:
+                outcomesDic.prune(next_turn)
+            elif outcome != FightOutcome.STILL_GOING:
+                outcomesDic.add(outcome, next_turn.__copy__())  # next_turn may be reused by nextTurns
+            else:
+                next_turn = next_turn.__copy__()
+                heappush(heap, (-next_turn.odds.numerator / next_turn.odds.denominator, pushed, next_turn))
+                pushed += 1
+                unexplored += next_turn.odds
+        if turn is not None:
+            outcomesDic.total_odds[FightOutcome.PRUNED].in_place_add(turn.odds - reached)
+
+        if len(heap) == 0 or explored == node_budget:
+            break
+        if explored % check_every == 0:
+            if seconds is not None and time.perf_counter() - start >= seconds:
+                break
+            if target_width is not None and oddsFraction(unexplored) - pruned_before \
+                    + oddsFraction(outcomesDic.total_odds[FightOutcome.PRUNED]) <= target_width:
+                break
+
+        _, _, turn = heappop(heap)
+        unexplored -= turn.odds
+        explored += 1
+        next_turns = nextTurns(turn)
+
+    for _, _, turn in heap:
+        outcomesDic.prune(turn)
+
+    added = outcomesDic.totalFraction() - total_before
+    if odds_backend == OddsBackend.EXACT and added != starting_odds:
+        raise ValueError(f'Outcomes add up to {added} instead of {starting_odds} : {outcomesDic.short_display()}')
+    return explored
+
+
+#
+# Monte Carlo engine
+#
+def sampleEndOfTurn(t: TurnActions, rng: random.Random):
+    """Plays the poison tick or who plays next, like doEndOfTurn. The poison tick only happens once."""
+    if t.wasJustPoisoned:
+        t.wasJustPoisoned = False
+    elif t.player.isPoisoned and not t.wasPoisonApplied:
+        t.player.currHP -= t.player.hp // 8
+        t.wasPoisonApplied = True
+        return
+
+    t.hasPlayerPlayed = False
+    t.hasEnemyPlayed = False
+    t.wasPoisonApplied = False
+    t.playerMod.turn += 1
+    t.enemyMod.turn += 1
+
+    playerSpd = t.playerMod.modSpd(t.player)
+    enemySpd = t.enemyMod.modSpd(t.enemy)
+    if playerSpd == enemySpd:
+        t.whoFightsNext = WhoFights.PLAYER if rng.random() < 0.5 else WhoFights.ENEMY
+    else:
+        t.whoFightsNext = WhoFights.PLAYER if playerSpd > enemySpd else WhoFights.ENEMY
+
+
+def samplePlayerTurn(t: TurnActions, rng: random.Random):
+    """Plays the player's Rage, like doPlayerTurn"""
+    is_crit = rng.randrange(16) == 0
+    t.enemy.currHP -= calc_damage(RAGE, t.player, t.enemy, t.playerMod, t.enemyMod, rng.randint(MIN_RANGE, MAX_RANGE),
+                                  is_crit, t.playerMod.rageNb)
+    t.hasPlayerPlayed = True
+    t.whoFightsNext = WhoFights.ENEMY
+
+
+def sampleBadOutcome(rng: random.Random, p: float, bias=1):
+    """Whether a bad outcome of probability p happens, its odds being multiplied by bias,
+    and the likelihood ratio of the draw"""
+    q = p if bias == 1 else bias * p / (bias * p + 1 - p)
+    if rng.random() < q:
+        return True, p / q
+    return False, (1 - p) / (1 - q)
+
+
+def sampleEnemyTurn(t: TurnActions, rng: random.Random, bias=1):
+    """Plays the enemy's move, AI choice included, like doEnemyTurn. The odds of every bad outcome counted by
+    remainingBadOutcomes, and of enemy crits, are multiplied by bias. Returns the likelihood ratio of the move."""
+    move_odds = [float(oddsFraction(odds)) for odds in enemyMoveOdds(t.enemy.moves, t.playerMod, t.enemyMod,
+                                                                     t.player, t.enemy)]
+    biased_odds = [odds * bias if move.effect == MoveEffect.DEFENSE_UP else odds
+                   for move, odds in zip(t.enemy.moves, move_odds)]
+    idx = rng.choices(range(len(t.enemy.moves)), biased_odds)[0]
+    move = t.enemy.moves[idx]
+    ratio = move_odds[idx] / biased_odds[idx] * sum(biased_odds) / sum(move_odds)
+
+    if move.power >= 2:
+        is_miss, miss_ratio = sampleBadOutcome(rng, (100 - move.accuracy) / 100, bias)
+        ratio *= miss_ratio
+        if not is_miss:
+            is_crit, crit_ratio = sampleBadOutcome(rng, 1 / 16, bias)
+            ratio *= crit_ratio
+            t.player.currHP -= calc_damage(move, t.enemy, t.player, t.enemyMod, t.playerMod,
+                                           rng.randint(MIN_RANGE, MAX_RANGE), is_crit, enemyMultiplier(move, t.enemyMod))
+            t.playerMod.rageNb = min(8, t.playerMod.rageNb + 1)
+            if move.name == FURY_CUTTER.name:
+                t.enemyMod.furycutterNb = min(5, t.enemyMod.furycutterNb + 1)
+            if move.effect == MoveEffect.POISON_HIT and not t.player.isPoisoned:
+                is_poisoned, poison_ratio = sampleBadOutcome(rng, move.effectChance / 100, bias)
+                ratio *= poison_ratio
+                if is_poisoned:
+                    t.player.isPoisoned = True
+                    t.wasJustPoisoned = True
+        elif move.name == FURY_CUTTER.name:
+            t.enemyMod.furycutterNb = 0
+    elif move.power == 0:
+        if move.effect == MoveEffect.DEFENSE_UP:
+            t.enemyMod.deff = t.enemyMod.bound(t.enemyMod.deff + 1)
+        elif move.effect == MoveEffect.SPEED_DOWN or move.effect == MoveEffect.DEFENSE_DOWN:
+            is_hit, hit_ratio = sampleBadOutcome(rng, move.accuracy / 100 * 3 / 4, bias)  # no miss, no AI miss
+            ratio *= hit_ratio
+            if is_hit:
+                if move.effect == MoveEffect.SPEED_DOWN:
+                    t.playerMod.spd = t.playerMod.bound(t.playerMod.spd - 1)
+                else:
+                    t.playerMod.deff = t.playerMod.bound(t.playerMod.deff - 1)
+
+    t.hasEnemyPlayed = True
+    t.whoFightsNext = WhoFights.PLAYER
+    return ratio
+
+
+def sampleWeightedFight(t: TurnActions, rng: random.Random, bias=1):
+    """Plays one battle from t, which is modified, with the odds of the bad outcomes multiplied by bias
+    (see sampleEnemyTurn). Returns its FightOutcome and its likelihood ratio."""
+    t.remainingBadOutcomes = 0
+    ratio = 1.
+    while True:
+        outcome = fightOutcome(t)
+        if outcome != FightOutcome.STILL_GOING:
+            return outcome, ratio
+
+        if t.hasPlayerPlayed and t.hasEnemyPlayed:
+            sampleEndOfTurn(t, rng)
+        elif not t.hasPlayerPlayed and t.whoFightsNext == WhoFights.PLAYER:
+            samplePlayerTurn(t, rng)
+        elif not t.hasEnemyPlayed and t.whoFightsNext == WhoFights.ENEMY:
+            ratio *= sampleEnemyTurn(t, rng, bias)
+        else:
+            raise ValueError(f'Nobody can play after {t}')
+
+
+def sampleFight(t: TurnActions, rng: random.Random):
+    """Plays one battle from t, which is modified, and returns its FightOutcome.
+    Nothing is pruned : neither MAX_BAD_OUTCOME nor allow_crits_for_player and allow_crits_for_enemy apply."""
+    return sampleWeightedFight(t, rng)[0]
+
+
+class MonteCarloResult:
+    """Number of battles ending with each outcome, with Wilson score intervals for their probabilities"""
+    def __init__(self, z=1.96):
+        self.z = z  # 1.96 for 95% intervals
+        self.counts = {FightOutcome.PLAYER_IS_KO: 0, FightOutcome.ENEMY_IS_KO: 0}
+        self.samples = 0
+
+    def add(self, outcome: FightOutcome, count=1):
+        self.counts[outcome] += count
+        self.samples += count
+
+    def estimate(self, outcome: FightOutcome):
+        return self.counts[outcome] / self.samples
+
+    def interval(self, outcome: FightOutcome):
+        p, n, z = self.estimate(outcome), self.samples, self.z
+        center = (p + z * z / (2 * n)) / (1 + z * z / n)
+        half_width = z * sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return center - half_width, center + half_width
+
+    def width(self):
+        return max(high - low for low, high in (self.interval(outcome) for outcome in self.counts))
+
+    def prunedOdds(self, total_odds: dict, starting_odds=Fraction(1)):
+        """Estimated odds of each outcome that the exact engine didn't reach, from its total_odds when fighting starting
+        turns of starting_odds in total : what MAX_BAD_OUTCOME and disabled crits pruned. Can be negative against
+        checkpoints of RULES_VERSION 1, which counted the odds after a poison tick twice."""
+        return {outcome: self.estimate(outcome) * float(starting_odds) - float(oddsFraction(total_odds[outcome]))
+                for outcome in self.counts}
+
+    def short_display(self):
+        return ', '.join(f'{outcome.name}={100 * self.estimate(outcome):.4f}% '
+                         f'[{100 * self.interval(outcome)[0]:.4f}%, {100 * self.interval(outcome)[1]:.4f}%]'
+                         for outcome in self.counts) + f', samples={self.samples}'
+
+
+class ImportanceSamplingResult(MonteCarloResult):
+    """Sums of the likelihood ratios of the battles ending with each outcome : unbiased estimates of their
+    probabilities, with normal intervals from the variance of the ratios"""
+    def __init__(self, z=1.96):
+        super().__init__(z)
+        self.counts = {outcome: 0. for outcome in self.counts}
+        self.squares = {outcome: 0. for outcome in self.counts}  # sums of the squared ratios
+
+    def add(self, outcome: FightOutcome, ratio=1.):
+        self.counts[outcome] += ratio
+        self.squares[outcome] += ratio * ratio
+        self.samples += 1
+
+    def variance(self, outcome: FightOutcome):
+        """Estimated variance of estimate(outcome)"""
+        n, p = self.samples, self.estimate(outcome)
+        return max(self.squares[outcome] / n - p * p, 0) / (n - 1) if n > 1 else float('inf')
+
+    def interval(self, outcome: FightOutcome):
+        p, half_width = self.estimate(outcome), self.z * sqrt(self.variance(outcome))
+        return p - half_width, p + half_width
+
+    def short_display(self):
+        return ', '.join(f'{outcome.name}={100 * self.estimate(outcome):.6f}% '
+                         f'[{100 * self.interval(outcome)[0]:.6f}%, {100 * self.interval(outcome)[1]:.6f}%] '
+                         f'variance={self.variance(outcome):.3e}'
+                         for outcome in self.counts) + f', samples={self.samples}'
+
+
+def fightImportanceSampling(turns: list[TurnActions], samples: int, bias: float, seed=0, target_width=None,
+                            check_every=1000):
+    """Like fightMonteCarlo, with the odds of the bad outcomes multiplied by bias : bias > 1 samples more of the
+    rare battles where the player is KO, each battle counting for its likelihood ratio."""
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(float(oddsFraction(turn.odds)) for turn in turns))
+    result = ImportanceSamplingResult()
+    for i in range(samples):
+        turn = turns[0] if len(turns) == 1 else rng.choices(turns, cum_weights=cum_weights)[0]
+        result.add(*sampleWeightedFight(turn.__copy__(), rng, bias))
+        if target_width is not None and (i + 1) % check_every == 0 and result.width() <= target_width:
+            break
+    return result
+
+
+def fightMonteCarlo(turns: list[TurnActions], samples: int, seed=0, target_width=None, check_every=1000):
+    """Plays up to samples battles, each one from a starting turn drawn with its odds, and stops early once both
+    intervals are at most target_width wide. Same rules as nextTurns, without any pruning (see sampleFight)."""
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(float(oddsFraction(turn.odds)) for turn in turns))
+    result = MonteCarloResult()
+    for i in range(samples):
+        turn = turns[0] if len(turns) == 1 else rng.choices(turns, cum_weights=cum_weights)[0]
+        result.add(sampleFight(turn.__copy__(), rng))
+        if target_width is not None and (i + 1) % check_every == 0 and result.width() <= target_width:
+            break
+    return result
+
+
+#
+# Batch Monte Carlo engine
+#
+class BattleBatch:
+    """Battles as numpy columns, one row per battle : the fields of TurnActions that can change during a fight.
+    Attack stages and the enemy speed stage never change, see BatchFight."""
+    COLUMNS = {'player_hp': np.int32, 'enemy_hp': np.int32, 'rage': np.int8, 'furycutter': np.int8,
+               'player_deff': np.int8, 'player_spd': np.int8, 'enemy_deff': np.int8,
+               'player_turn': np.int8, 'enemy_turn': np.int8, 'poisoned': bool, 'just_poisoned': bool,
+               'poison_applied': bool, 'player_played': bool, 'enemy_played': bool,
+               'player_next': bool} if np is not None else {}
+
+    def __init__(self, columns: dict):
+        self.__dict__.update(columns)
+
+    @staticmethod
+    def fromTurn(t: TurnActions, size: int):
+        """size battles starting at t"""
+        values = {'player_hp': t.player.currHP, 'enemy_hp': t.enemy.currHP, 'rage': t.playerMod.rageNb,
+                  'furycutter': t.enemyMod.furycutterNb, 'player_deff': t.playerMod.deff,
+                  'player_spd': t.playerMod.spd, 'enemy_deff': t.enemyMod.deff, 'player_turn': t.playerMod.turn,
+                  'enemy_turn': t.enemyMod.turn, 'poisoned': t.player.isPoisoned, 'just_poisoned': t.wasJustPoisoned,
+                  'poison_applied': t.wasPoisonApplied, 'player_played': t.hasPlayerPlayed,
+                  'enemy_played': t.hasEnemyPlayed, 'player_next': t.whoFightsNext == WhoFights.PLAYER}
+        return BattleBatch({name: np.full(size, values[name], dtype) for name, dtype in BattleBatch.COLUMNS.items()})
+
+    def __len__(self):
+        return len(self.player_hp)
+
+    def take(self, rows):
+        return BattleBatch({name: getattr(self, name)[rows] for name in BattleBatch.COLUMNS})
+
+    @staticmethod
+    def concatenate(batches: list['BattleBatch']):
+        return BattleBatch({name: np.concatenate([getattr(b, name) for b in batches]) for name in BattleBatch.COLUMNS})
+
+    def carryOver(self, hp_gain: int, enemy: Pokemon):
+        """Starts the fight against enemy, like carryOverTurn once the player gained hp_gain max HP"""
+        self.player_hp += hp_gain
+        self.enemy_hp[:] = enemy.currHP
+        self.furycutter[:] = 0
+        self.enemy_deff[:] = 0
+        self.enemy_turn[:] = 0
+        self.player_played[:] = True
+        self.enemy_played[:] = True
+        self.poison_applied[:] = True
+        self.just_poisoned[:] = False
+
+
+class BatchFight:
+    """Everything that stays the same during the fights between player and enemy, tabulated for BattleBatch"""
+    def __init__(self, player: Pokemon, enemy: Pokemon, playerAtk=0, enemyAtk=0, enemySpd=0):
+        if np is None:
+            raise ImportError('BatchFight needs numpy')
+        self.player = player
+        self.enemy = enemy
+        self.playerAtk = playerAtk
+        self.enemyAtk = enemyAtk
+
+        stages = np.arange(-6, 7)[:, None]
+        # [enemy_deff + 6, rage - 1, crit, roll - MIN_RANGE]
+        self.rage_damage = calc_damage_batch(RAGE, player, enemy, playerAtk, stages,
+                                             np.arange(1, 9)[None, :]).astype(np.int32)
+        # [player_deff + 6, furycutter, crit, roll - MIN_RANGE] of every damaging move
+        self.move_damage = [calc_damage_batch(move, enemy, player, enemyAtk, stages,
+                                              np.array([enemyMultiplier(move, StatModifier(furycutterNb=nb))
+                                                        for nb in range(6)])[None, :]).astype(np.int32)
+                            if move.power >= 2 else None for move in enemy.moves]
+        self.player_speeds = np.array([StatModifier(spd=stage).modSpd(player) for stage in range(-6, 7)])
+        self.enemy_speed = StatModifier(spd=enemySpd).modSpd(enemy)
+        self.poison_damage = player.hp // 8
+        # Cumulated odds of the enemy moves, filled when first needed :
+        # [enemyMod.turn == 1, playerMod.turn == 1, furycutterNb, enemy HP <= 25%, player_deff + 6, player HP]
+        self.ai_cum_odds = np.full((2, 2, 6, 2, 13, player.hp + 1, len(enemy.moves)), np.nan)
+
+    def aiCumOdds(self, index):
+        """Cumulated odds of the enemy moves for the flat index of ai_cum_odds, from enemyMoveOdds"""
+        enemyTurn1, playerTurn1, furycutterNb, low, deff, hp = np.unravel_index(index, self.ai_cum_odds.shape[:-1])
+        playerMod = StatModifier(atk=self.playerAtk, deff=int(deff) - 6, turn=1 if playerTurn1 else 2)
+        enemyMod = StatModifier(atk=self.enemyAtk, furycutterNb=int(furycutterNb), turn=1 if enemyTurn1 else 2)
+        player = self.player.__copy__()
+        player.currHP = int(hp)
+        enemy = self.enemy.__copy__()
+        enemy.currHP = 1 if low else enemy.hp
+        move_odds = enemyMoveOdds(enemy.moves, playerMod, enemyMod, player, enemy)
+        return np.cumsum([float(oddsFraction(odds)) for odds in move_odds])
+
+    def moveChoices(self, b: BattleBatch, rows, u):
+        """Indexes of the moves the AI chooses for rows, u being uniform draws in [0, 1)"""
+        index = np.ravel_multi_index((b.enemy_turn[rows] == 1, b.player_turn[rows] == 1, b.furycutter[rows],
+                                      100 * b.enemy_hp[rows] / self.enemy.hp <= 25, b.player_deff[rows] + 6,
+                                      b.player_hp[rows]), self.ai_cum_odds.shape[:-1])
+        cum_odds = self.ai_cum_odds.reshape(-1, len(self.enemy.moves))
+        for missing in np.unique(index[np.isnan(cum_odds[index, 0])]):
+            cum_odds[missing] = self.aiCumOdds(missing)
+        return np.minimum((u[:, None] >= cum_odds[index]).sum(axis=1), len(self.enemy.moves) - 1)
+
+    def endOfTurn(self, b: BattleBatch, rows, rng):
+        """Poison tick or who plays next for rows, like sampleEndOfTurn"""
+        just = b.just_poisoned[rows]
+        b.just_poisoned[rows[just]] = False
+        tick = ~just & b.poisoned[rows] & ~b.poison_applied[rows]
+        b.player_hp[rows[tick]] -= self.poison_damage
+        b.poison_applied[rows[tick]] = True
+
+        rows = rows[~tick]
+        b.player_played[rows] = False
+        b.enemy_played[rows] = False
+        b.poison_applied[rows] = False
+        b.player_turn[rows] += 1
+        b.enemy_turn[rows] += 1
+        player_speeds = self.player_speeds[b.player_spd[rows] + 6]
+        b.player_next[rows] = (player_speeds > self.enemy_speed) \
+            | (player_speeds == self.enemy_speed) & (rng.random(len(rows)) < 0.5)
+
+    def playerTurn(self, b: BattleBatch, rows, rng):
+        """Rage for rows, like samplePlayerTurn"""
+        draws = rng.integers(0, 16 * 39, len(rows))  # crit and roll
+        b.enemy_hp[rows] -= self.rage_damage[b.enemy_deff[rows] + 6, b.rage[rows] - 1,
+                                             (draws % 16 == 0).astype(np.intp), draws // 16]
+        b.player_played[rows] = True
+        b.player_next[rows] = False
+
+    def enemyTurn(self, b: BattleBatch, rows, rng):
+        """Enemy moves for rows, like sampleEnemyTurn"""
+        choices = self.moveChoices(b, rows, rng.random(len(rows)))
+        for i, move in enumerate(self.enemy.moves):
+            moveRows = rows[choices == i]
+            if move.power >= 2:
+                hit = rng.integers(0, 100, len(moveRows)) < move.accuracy
+                hits = moveRows[hit]
+                draws = rng.integers(0, 16 * 39, len(hits))  # crit and roll
+                b.player_hp[hits] -= self.move_damage[i][b.player_deff[hits] + 6, b.furycutter[hits],
+                                                         (draws % 16 == 0).astype(np.intp), draws // 16]
+                b.rage[hits] = np.minimum(b.rage[hits] + 1, 8)
+                if move.name == FURY_CUTTER.name:
+                    b.furycutter[hits] = np.minimum(b.furycutter[hits] + 1, 5)
+                    b.furycutter[moveRows[~hit]] = 0
+                if move.effect == MoveEffect.POISON_HIT:
+                    poisoned = hits[~b.poisoned[hits] & (rng.integers(0, 100, len(hits)) < move.effectChance)]
+                    b.poisoned[poisoned] = True
+                    b.just_poisoned[poisoned] = True
+            elif move.power == 0:
+                if move.effect == MoveEffect.DEFENSE_UP:
+                    b.enemy_deff[moveRows] = np.minimum(b.enemy_deff[moveRows] + 1, 6)
+                elif move.effect == MoveEffect.SPEED_DOWN or move.effect == MoveEffect.DEFENSE_DOWN:
+                    hits = moveRows[(rng.integers(0, 100, len(moveRows)) < move.accuracy)
+                                    & (rng.integers(0, 4, len(moveRows)) != 0)]  # no miss, no AI miss
+                    stages = b.player_spd if move.effect == MoveEffect.SPEED_DOWN else b.player_deff
+                    stages[hits] = np.maximum(stages[hits] - 1, -6)
+        b.enemy_played[rows] = True
+        b.player_next[rows] = True
+
+    def fight(self, b: BattleBatch, rng):
+        """Plays every battle of b until its end, one half-turn at a time for all of them, like sampleFight.
+        Returns the final battles, in another order, and whether the enemy is KO in each of them."""
+        finished, enemy_kos = [], []
+        while len(b) > 0:
+            enemy_ko = (b.enemy_hp <= 0) & (b.player_turn <= 20)  # in the order of fightOutcome
+            over = enemy_ko | (b.player_turn > 20) | (b.player_hp <= 0)
+            if over.any():
+                finished.append(b.take(over))
+                enemy_kos.append(enemy_ko[over])
+                b = b.take(~over)
+
+            end = b.player_played & b.enemy_played
+            player_rows = np.flatnonzero(~end & ~b.player_played & b.player_next)
+            enemy_rows = np.flatnonzero(~end & ~b.enemy_played & ~b.player_next)
+            end_rows = np.flatnonzero(end)
+            if len(player_rows) + len(enemy_rows) + len(end_rows) != len(b):
+                raise ValueError('Nobody can play in some battles')
+            self.endOfTurn(b, end_rows, rng)
+            self.playerTurn(b, player_rows, rng)
+            self.enemyTurn(b, enemy_rows, rng)
+        return BattleBatch.concatenate(finished), np.concatenate(enemy_kos)
+
+
+def fightPartyBatch(player: Pokemon, enemies: list[Pokemon], battles: int, seed=0, batch_size=1 << 20,
+                    target_width=None):
+    """Plays up to battles runs against the whole party, batch_size at a time, the player fighting each enemy once the
+    previous one is KO like the party loop does. Stops early once the party intervals are at most target_width wide.
+    Returns the MonteCarloResult of the whole party (PLAYER_IS_KO if the player is KO by any enemy) and the one of
+    each enemy, counting the battles reaching it."""
+    if np is None:
+        raise ImportError('fightPartyBatch needs numpy')
+    rng = np.random.default_rng(seed)
+    starting_turn = TurnActions('', player, enemies[0], playerMod, StatModifier(), Odds(1, 1))  # like firstTurns
+    fights, hp_gains = [], []
+    for i, enemy in enumerate(enemies):
+        if i > 0:  # like carryOverTurn
+            previous_hp = player.hp
+            player = player.__copy__()
+            player.gainStatExp(enemies[i - 1].species)
+            player.gainExp(enemies[i - 1].expGiven())
+            hp_gains.append(player.hp - previous_hp)
+        fights.append(BatchFight(player, enemy, playerMod.atk))
+
+    party, results = MonteCarloResult(), [MonteCarloResult() for _ in enemies]
+    while party.samples < battles:
+        size = min(batch_size, battles - party.samples)
+        b = BattleBatch.fromTurn(starting_turn, size)
+        for i, fight in enumerate(fights):
+            if i > 0:
+                b.carryOver(hp_gains[i - 1], enemies[i])
+            b, enemy_ko = fight.fight(b, rng)
+            b = b.take(enemy_ko)
+            results[i].add(FightOutcome.ENEMY_IS_KO, len(b))
+            results[i].add(FightOutcome.PLAYER_IS_KO, len(enemy_ko) - len(b))
+        party.add(FightOutcome.ENEMY_IS_KO, len(b))
+        party.add(FightOutcome.PLAYER_IS_KO, size - len(b))
+        if target_width is not None and party.width() <= target_width:
+            break
+    return party, results
+
+
+#
+# Carry-over scenarios
+#
+scenario_memo = {}  # memo of the current process, see runFight
+
+
+def fightScenario(turn: TurnActions):
+    """Fights a carry-over scenario on its own OutcomesDic, unless result_store already has its results"""
+    use_store = result_store is not None and not store_all_scenarii  # checkpoints only keep one scenario per entry
+    if use_store:
+        config = fightConfig(turn)
+        outcomesDic = result_store.get(config)
+        if outcomesDic is not None:
+            return outcomesDic
+
+    outcomesDic = OutcomesDic()
+    runFight(turn, outcomesDic, scenario_memo)
+    if use_store:
+        result_store.put(config, outcomesDic)
+    return outcomesDic
+
+
+def firstTurns(player: Pokemon, enemy: Pokemon):
+    """Branches of the fight against the first Pokémon after parallel_split_depth steps, which are fought (and saved)
+    like scenarios : the progress of this fight is saved, and resumed, every few of them"""
+    starting_turn = TurnActions("", player, enemy, playerMod, StatModifier(), Odds(1, 1))
+    items = []
+    splitFight(starting_turn, parallel_split_depth, items)
+    return [turn for _, turn in items]
+
+
+def carryOverTurn(t: TurnActions, odds: Odds, previous_enemy: Pokemon, enemy: Pokemon, enemyMod: StatModifier):
+    """Starting turn against enemy of the scenario t where previous_enemy is KO, once the player gained its experience"""
+    turn = t.__copy__()
+    # Update player
+    turn.player.gainStatExp(previous_enemy.species)
+    turn.player.gainExp(previous_enemy.expGiven())
+
+    # Update scenario
+    turn.odds = odds.__copy__()
+    turn.hasEnemyPlayed = True
+    turn.hasPlayerPlayed = True
+    turn.wasPoisonApplied = True
+    turn.wasJustPoisoned = False
+    turn.enemy = enemy
+    turn.enemyMod = enemyMod
+    return turn
+
+
+def startingKey(turn: TurnActions):
+    """Starting turns with the same key give the same results, apart from their odds"""
+    return turn.stateKey(), pokemonRecord(turn.player)
+
+
+def carryOverTurns(outcomesDic: OutcomesDic, previous_enemy: Pokemon, enemy: Pokemon):
+    """Yields the starting turns against enemy of every scenario of outcomesDic where previous_enemy is KO.
+    Scenarios starting the same way are merged. outcomesDic is not modified."""
+    enemyMod = StatModifier()
+    turns = {}  # startingKey -> turn
+    for t, (odds, _) in outcomesDic[FightOutcome.ENEMY_IS_KO].items():
+        turn = carryOverTurn(t, odds, previous_enemy, enemy, enemyMod)
+        key = startingKey(turn)
+        if key in turns:
+            turns[key].odds.in_place_add(turn.odds)
+        else:
+            turns[key] = turn
+
+    yield from turns.values()
+
+
+def fightScenarios(turns: list[TurnActions]):
+    """Yields the OutcomesDic of each scenario, in order. Scenarios are fought by scenario_workers processes."""
+    if scenario_workers > 1 and len(turns) > 1 and engine != Engine.PARALLEL:  # PARALLEL has its own processes
+        with ProcessPoolExecutor(scenario_workers) as executor:
+            yield from map(workerResult, executor.map(workerTask, repeat(fightScenario), turns))
+    else:
+        for turn in turns:
+            yield fightScenario(turn)
+
+
+#
+# Pipelined party
+#
+# Every party member is fought at the same time by its own process pool. Each starting turn is fought with odds of 1,
+# and the new ENEMY_IS_KO entries are sent to the next stage as soon as all the previous starting turns are fought,
+# which is when they are known to come first. The party loop then only has to scale and merge these results.
+PIPELINE_END = None  # sent after the last starting turn of a stage
+
+
+def pipelineStage(inbox: queue.Queue, outbox: queue.Queue, executor: ProcessPoolExecutor, results: dict,
+                  enemy: Pokemon, next_enemy: Pokemon, errors: list):
+    """Fights the starting turns from inbox, storing their OutcomesDic in results by startingKey"""
+    nextEnemyMod = StatModifier()
+    forwarded = set()  # ENEMY_IS_KO entries already sent to outbox
+    pending = deque()  # (startingKey, future), in reception order
+    max_pending = 2 * pipeline_workers
+
+    def collect():
+        key, future = pending.popleft()
+        results[key] = workerResult(future.result())
+        if outbox is not None:
+            for t in results[key][FightOutcome.ENEMY_IS_KO]:
+                if t not in forwarded:
+                    forwarded.add(t)
+                    outbox.put(carryOverTurn(t, Odds(1, 1), enemy, next_enemy, nextEnemyMod))
+
+    try:
+        while (turn := inbox.get()) is not PIPELINE_END:
+            key = startingKey(turn)
+            if key in results:  # merged by the previous stage
+                continue
+            turn = turn.__copy__()
+            turn.odds = Odds(1, 1)
+            results[key] = None  # until it's fought
+            pending.append((key, executor.submit(workerTask, fightScenario, turn)))
+            while pending and (pending[0][1].done() or len(pending) > max_pending):
+                collect()
+        while pending:
+            collect()
+    except Exception as e:
+        errors.append(e)
+        while turn is not PIPELINE_END:  # don't block the previous stage
+            turn = inbox.get()
+    finally:
+        if outbox is not None:
+            outbox.put(PIPELINE_END)
+
+
+def fightPartyPipelined(turns: list[TurnActions], enemies: list[Pokemon]):
+    """For each enemy, the OutcomesDic of every starting turn against it by startingKey, with odds of 1.
+    turns are the starting turns against the first enemy."""
+    if engine == Engine.PARALLEL:  # like fightScenarios : each worker would start fight_workers processes of its own
+        raise ValueError(f'Pipelined fights need an engine without its own processes, not {engine}')
+    executors = [ProcessPoolExecutor(pipeline_workers) for _ in enemies]
+    for executor in executors:
+        executor.submit(int).result()  # starts the processes now : forking once the stage threads run could deadlock
+
+    queues = [queue.Queue(pipeline_queue_size) for _ in enemies]
+    results = [{} for _ in enemies]
+    errors = []
+    threads = [threading.Thread(target=pipelineStage,
+                                args=(queues[stage], queues[stage + 1] if stage + 1 < len(enemies) else None,
+                                      executors[stage], results[stage], enemy,
+                                      enemies[stage + 1] if stage + 1 < len(enemies) else None, errors))
+               for stage, enemy in enumerate(enemies)]
+    for thread in threads:
+        thread.start()
+    for turn in turns:
+        queues[0].put(turn)
+    queues[0].put(PIPELINE_END)
+    for thread in threads:
+        thread.join()
+    for executor in executors:
+        executor.shutdown()
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+#
+# Checkpoints
+#
+# A checkpoint file is, in little endian :
+#   CHECKPOINT_MAGIC, u16 version, u32 header length, JSON header (config, Pokémon table, outcomes, column widths)
+#   then one column after the other, each being one fixed width unsigned int per row.
+# Rows are the OutcomesDic entries (PLAYER_IS_KO ones first), in insertion order : the packed state key of the
+# first scenario of the entry, its player and enemy (indexes in the Pokémon table) and the entry's odds.
+# Scenario names and the other scenarios of an entry (store_all_scenarii) are not saved.
+# The PRUNED odds, if any, are saved in the header as an outcome without rows.
+CHECKPOINT_MAGIC = b'BGSYCKPT'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_COLUMNS = ['state_key', 'player', 'enemy', 'numerator', 'denominator']
+
+
+def pokemonRecord(pokemon: Pokemon):
+    """Everything needed to rebuild pokemon, except currHP and isPoisoned which are in the state key"""
+    return (pokemon.species.dex, pokemon.level, tuple(pokemon.ivs),
+            pokemon.ev_hp, pokemon.ev_hp_used, pokemon.ev_atk, pokemon.ev_atk_used, pokemon.ev_def, pokemon.ev_def_used,
+            pokemon.ev_spd, pokemon.ev_spd_used, pokemon.ev_spc, pokemon.ev_spc_used,
+            tuple(move.index for move in pokemon.moves), pokemon.wild, tuple(pokemon.elementalBadgeBoosts),
+            pokemon.atkBadge, pokemon.defBadge, pokemon.spdBadge, pokemon.spcBadge, pokemon.totalExp)
+
+
+def pokemonFromRecord(record):
+    (dex, level, ivs, ev_hp, ev_hp_used, ev_atk, ev_atk_used, ev_def, ev_def_used, ev_spd, ev_spd_used, ev_spc,
+     ev_spc_used, moves, wild, elementalBadgeBoosts, atkBadge, defBadge, spdBadge, spcBadge, totalExp) = record
+    return Pokemon(SPECIES_BY_DEX[dex], level, list(ivs),
+                   ev_hp, ev_hp_used, ev_atk, ev_atk_used, ev_def, ev_def_used, ev_spd, ev_spd_used, ev_spc, ev_spc_used,
+                   [MOVES_BY_INDEX[index] for index in moves], wild,
+                   list(elementalBadgeBoosts), atkBadge, defBadge, spdBadge, spcBadge, totalExp)
+
+
+def writeCheckpoint(path, outcomesDic: OutcomesDic, config: dict):
+    """Saves outcomesDic at path in the checkpoint format, config is stored as is in the header"""
+    records = {}  # record -> index in the Pokémon table
+    columns = {name: [] for name in CHECKPOINT_COLUMNS}
+    outcomes = []
+    for outcome in [FightOutcome.PLAYER_IS_KO, FightOutcome.ENEMY_IS_KO]:
+        for odds, turns in outcomesDic[outcome].values():
+            t = turns[0]
+            if not isinstance(odds, Odds):
+                odds = oddsFraction(odds)  # the other backends are saved exactly too
+            columns['state_key'].append(t.stateKey())
+            columns['player'].append(records.setdefault(pokemonRecord(t.player), len(records)))
+            columns['enemy'].append(records.setdefault(pokemonRecord(t.enemy), len(records)))
+            columns['numerator'].append(odds.numerator)
+            columns['denominator'].append(odds.denominator)
+        total_odds = oddsFraction(outcomesDic.total_odds[outcome])
+        outcomes.append({'outcome': outcome.name, 'rows': len(outcomesDic[outcome]),
+                         'total_odds': [total_odds.numerator, total_odds.denominator]})
+    if outcomesDic.total_odds[FightOutcome.PRUNED].numerator != 0:
+        pruned_odds = oddsFraction(outcomesDic.total_odds[FightOutcome.PRUNED])
+        outcomes.append({'outcome': FightOutcome.PRUNED.name, 'rows': 0,
+                         'total_odds': [pruned_odds.numerator, pruned_odds.denominator]})
+
+    widths = {name: max([1] + [(value.bit_length() + 7) // 8 for value in values]) for name, values in columns.items()}
+    header = json.dumps({'config': config, 'pokemon': list(records), 'outcomes': outcomes,
+                         'columns': [[name, widths[name]] for name in CHECKPOINT_COLUMNS]}).encode()
+
+    with open(path, 'wb') as file:
+        file.write(CHECKPOINT_MAGIC + struct.pack('<HI', CHECKPOINT_VERSION, len(header)) + header)
+        for name in CHECKPOINT_COLUMNS:
+            file.write(b''.join(value.to_bytes(widths[name], 'little') for value in columns[name]))
+
+
+class Checkpoint:
+    """Checkpoint file read through mmap : rows are only decoded when accessed"""
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        offset = len(CHECKPOINT_MAGIC)
+        if self.mm[:offset] != CHECKPOINT_MAGIC:
+            raise ValueError(f'{path} is not a checkpoint file')
+        version, header_length = struct.unpack_from('<HI', self.mm, offset)
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f'{path} has checkpoint version {version}, only version {CHECKPOINT_VERSION} is supported')
+        offset += struct.calcsize('<HI')
+        header = json.loads(self.mm[offset:offset + header_length])
+        offset += header_length
+
+        self.config = header['config']
+        self.pokemon = [pokemonFromRecord(record) for record in header['pokemon']]
+        self.rows = {}  # outcome -> range of its rows
+        self.total_odds = {}
+        start = 0
+        for entry in header['outcomes']:
+            outcome = FightOutcome[entry['outcome']]
+            self.rows[outcome] = range(start, start + entry['rows'])
+            self.total_odds[outcome] = Odds(*entry['total_odds'])
+            start += entry['rows']
+        self.columns = {}  # name -> (offset, width)
+        for name, width in header['columns']:
+            self.columns[name] = (offset, width)
+            offset += start * width
+        if len(self.mm) < offset:
+            raise ValueError(f'{path} is truncated : {len(self.mm)} bytes instead of {offset}')
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def value(self, name, row):
+        offset, width = self.columns[name]
+        offset += row * width
+        return int.from_bytes(self.mm[offset:offset + width], 'little')
+
+    def odds(self, row):
+        odds = Odds.__new__(Odds)  # exact, kept as saved
+        odds.numerator = self.value('numerator', row)
+        odds.denominator = self.value('denominator', row)
+        return odds
+
+    def turn(self, row):
+        return TurnActions.fromStateKey(self.value('state_key', row), self.pokemon[self.value('player', row)],
+                                        self.pokemon[self.value('enemy', row)], self.odds(row))
+
+    def toOutcomesDic(self):
+        outcomesDic = OutcomesDic()
+        for outcome, rows in self.rows.items():
+            for row in rows:
+                t = self.turn(row)
+                outcomesDic[outcome][t] = (t.odds, [t])
+            outcomesDic.total_odds[outcome] = self.total_odds[outcome]
+        return outcomesDic
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+    """Loads pickles made by running bugsy.py or busgy2.py as a script"""
+    def find_class(self, module, name):
+        if module == '__main__':
+            return globals()[name]
+        return super().find_class(module, name)
+
+
+def convertPickle(path, checkpoint_path=None):
+    """Converts an OutcomesDic pickle (named '{enemy},{info_str}' in emptydics) to a checkpoint next to it"""
+    with open(path, 'rb') as file:
+        outcomesDic: OutcomesDic = CheckpointUnpickler(file).load()
+
+    checkpoint_path = checkpoint_path or path + '.ckpt'
+    enemy_name, _, info = os.path.basename(path).partition(',')
+    writeCheckpoint(checkpoint_path, outcomesDic, {'enemy': enemy_name, 'info': info})
+
+    # The checkpoint must give back the same entries
+    with Checkpoint(checkpoint_path) as checkpoint:
+        for outcome, rows in checkpoint.rows.items():
+            for row, (odds, turns) in zip(rows, outcomesDic[outcome].values()):
+                if checkpoint.value('state_key', row) != turns[0].stateKey() \
+                        or oddsFraction(checkpoint.odds(row)) != oddsFraction(odds) \
+                        or checkpoint.turn(row).stateKey() != turns[0].stateKey() \
+                        or any(pokemonRecord(a) != pokemonRecord(b) or a.hp != b.hp or a.spd != b.spd
+                               for a, b in [(checkpoint.turn(row).player, turns[0].player),
+                                            (checkpoint.turn(row).enemy, turns[0].enemy)]):
+                    raise ValueError(f'Row {row} of {checkpoint_path} differs from {turns[0]}')
+    return checkpoint_path
+
+
+def loadOutcomesDic(path):
+    """Reads the checkpoint of path, or else the pickle at path, converted in a temporary directory so that loading
+    gives the same OutcomesDic either way without writing next to the pickle"""
+    if os.path.exists(path + '.ckpt'):
+        with Checkpoint(path + '.ckpt') as checkpoint:
+            return checkpoint.toOutcomesDic()
+
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_path = convertPickle(path, os.path.join(directory, 'converted.ckpt'))
+        with Checkpoint(checkpoint_path) as checkpoint:
+            return checkpoint.toOutcomesDic()
+
+
+#
+# Result store
+#
+RULES_VERSION = 2  # to increase whenever the battle logic changes the results of a fight
+
+
+def fightConfig(starting_turn: TurnActions):
+    """Everything the results of a fight depend on"""
+    odds = oddsFraction(starting_turn.odds)
+    return {'rules_version': RULES_VERSION, 'checkpoint_version': CHECKPOINT_VERSION,
+            'player': pokemonRecord(starting_turn.player), 'enemy': pokemonRecord(starting_turn.enemy),
+            'state_key': starting_turn.stateKey(), 'odds': [odds.numerator, odds.denominator],
+            'MAX_BAD_OUTCOME': TurnActions.MAX_BAD_OUTCOME, 'allow_crits_for_player': allow_crits_for_player,
+            'allow_crits_for_enemy': allow_crits_for_enemy, 'odds_backend': odds_backend.name, 'engine': engine.name} \
+        | ({'prune_epsilon': [prune_epsilon.numerator, prune_epsilon.denominator]} if prune_epsilon is not None else {})
+
+
+def configHash(config: dict):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class ResultStore:
+    """Fight results saved as checkpoints named after the hash of their fightConfig.
+    The least recently used results are deleted once the store takes more than max_bytes. Each process keeps its own
+    running size of the store, so the files other processes put are only counted when it next evicts."""
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = None  # bytes taken by the store, scanned on the first put
+
+    def __repr__(self):
+        return f'ResultStore({self.directory!r}, {self.max_bytes}, {self.hits=}, {self.misses=})'
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.ckpt')
+
+    def get(self, config: dict):
+        """OutcomesDic saved for config, None if there is none. Unreadable files are deleted and count as misses."""
+        path = self.path(configHash(config))
+        try:
+            with Checkpoint(path) as checkpoint:
+                if checkpoint.config != json.loads(json.dumps(config)):  # hash collision
+                    self.misses += 1
+                    return None
+                outcomesDic = checkpoint.toOutcomesDic()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (ValueError, struct.error, OSError):  # corrupted, or truncated by a crash
+            self.misses += 1
+            self.remove(path)
+            return None
+
+        try:
+            os.utime(path)  # most recently used
+        except FileNotFoundError:  # already evicted by another process
+            pass
+        self.hits += 1
+        return outcomesDic.toOddsBackend()
+
+    def put(self, config: dict, outcomesDic: OutcomesDic):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(configHash(config))
+        temp_path = f'{path}.{os.getpid()}.tmp'  # other processes never see a partial file
+        writeCheckpoint(temp_path, outcomesDic, config)
+        added = os.path.getsize(temp_path)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(temp_path, path)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += added - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """(last use, size, path) of every result of the store"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.ckpt'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def remove(self, path):
+        """Deletes the result at path, if no other process did"""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:  # already removed by another process
+            return
+        if self.size is not None:
+            self.size -= size
+
+    def evict(self):
+        """Deletes the least recently used results until the store fits in max_bytes"""
+        entries = self.entries()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # already evicted by another process
+                pass
+            self.size -= size
+
+
+#
+# Progress
+#
+PROGRESS_PATH = 'emptydics/progress.ckpt'  # OutcomesDic of the current stage of the party loop, so far
+
+
+def progressInputPath(stage: int):
+    return f'emptydics/progress_input_{stage}.ckpt'  # OutcomesDic the stage starts from
+
+
+def runConfig(input_path, player: Pokemon):
+    """Everything the party loop results depend on"""
+    return {'rules_version': RULES_VERSION, 'input': input_path, 'player': pokemonRecord(player),
+            'currHP': player.currHP, 'party': [pokemonRecord(enemy) for enemy in party],
+            'MAX_BAD_OUTCOME': TurnActions.MAX_BAD_OUTCOME, 'allow_crits_for_player': allow_crits_for_player,
+            'allow_crits_for_enemy': allow_crits_for_enemy, 'store_all_scenarii': store_all_scenarii,
+            'odds_backend': odds_backend.name, 'engine': engine.name} \
+        | ({'prune_epsilon': [prune_epsilon.numerator, prune_epsilon.denominator]} if prune_epsilon is not None else {})
+
+
+def saveProgress(path, outcomesDic: OutcomesDic, config: dict):
+    """writeCheckpoint, but being killed while saving leaves the previous file untouched"""
+    temp_path = path + '.tmp'
+    writeCheckpoint(temp_path, outcomesDic, config)
+    os.replace(temp_path, path)
+
+
+def loadProgress(run_hash):
+    """(progress config, stage input OutcomesDic, stage OutcomesDic so far) of the last progress saved by the run of
+    hash run_hash, None if there is none"""
+    try:
+        with Checkpoint(PROGRESS_PATH) as checkpoint:
+            if checkpoint.config['run'] != run_hash:
+                return None
+            config = checkpoint.config
+            outcomesDic = checkpoint.toOutcomesDic()
+        with Checkpoint(progressInputPath(config['stage'])) as checkpoint:
+            if checkpoint.config['run'] != run_hash:
+                return None
+            inputOutcomesDic = checkpoint.toOutcomesDic()
+    except FileNotFoundError:
+        return None
+    return config, inputOutcomesDic.toOddsBackend(), outcomesDic.toOddsBackend()
+
+
+def clearProgress():
+    for path in [PROGRESS_PATH] + [progressInputPath(stage) for stage in range(len(party))]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+#
+# Instrumentation
+#
+class Instrumentation:
+    """Counters of the current process. Worker processes count (and emit) on their own, with their pid, and send their
+    counters back with the results of their tasks (see workerTask) : the parent adds them up in its own emits."""
+    def __init__(self, stream, interval):
+        self.stream = stream
+        self.interval = interval
+        self.start = self.last_emit = time.perf_counter()
+        self.nodes = 0  # turns expanded by nextTurns
+        self.nodes_at_last_emit = 0
+        self.branching = {}  # battle turn -> [expanded turns, yielded turns]
+        self.leaves = {FightOutcome.PLAYER_IS_KO.name: 0, FightOutcome.ENEMY_IS_KO.name: 0, 'PRUNED': 0}
+        self.seconds = {'damage': 0.0, 'ai': 0.0, 'copy': 0.0}  # ai includes the damage it calculates
+        self.calls = {'damage': 0, 'ai': 0, 'copy': 0}
+        self.caches_at_start = {'damage': (damage_cache.hits, damage_cache.misses),
+                                'ai': (ai_cache.hits, ai_cache.misses)}  # forked workers inherit the caches
+        self.workers = {}  # (pid, start) of each worker process -> its last counters
+        self.engine = {}  # last progress of the engines of this process, see reportProgress
+
+    def counters(self):
+        """Everything this process counted, see totals"""
+        caches = {'damage': damage_cache, 'ai': ai_cache}
+        return {'nodes': self.nodes, 'branching': {depth: list(counts) for depth, counts in self.branching.items()},
+                'leaves': dict(self.leaves), 'seconds': dict(self.seconds), 'calls': dict(self.calls),
+                'caches': {name: [cache.hits - self.caches_at_start[name][0], cache.misses - self.caches_at_start[name][1]]
+                           for name, cache in caches.items()}}
+
+    def totals(self):
+        """counters of this process and of its workers, added up"""
+        totals = self.counters()
+        for counters in self.workers.values():
+            totals['nodes'] += counters['nodes']
+            for depth, (expanded, children) in counters['branching'].items():
+                counts = totals['branching'].setdefault(depth, [0, 0])
+                counts[0] += expanded
+                counts[1] += children
+            for name in ['leaves', 'seconds', 'calls', 'caches']:
+                for key, value in counters[name].items():
+                    totals[name][key] = [a + b for a, b in zip(totals[name][key], value)] if name == 'caches' \
+                        else totals[name][key] + value
+        return totals
+
+    def snapshot(self, event):
+        now = time.perf_counter()
+        elapsed = now - self.start
+        totals = self.totals()
+        return {'event': event, 'pid': os.getpid(), 'workers': len(self.workers), 'elapsed': round(elapsed, 3),
+                'nodes': totals['nodes'],
+                'nodes_per_s': round((totals['nodes'] - self.nodes_at_last_emit) / max(now - self.last_emit, 1e-9)),
+                'leaves': totals['leaves'],
+                'seconds': {name: round(seconds, 3) for name, seconds in totals['seconds'].items()},
+                'calls': totals['calls'],
+                'hit_rates': {name: 100 * hits / max(hits + misses, 1) for name, (hits, misses) in totals['caches'].items()}
+                             | {'result_store': 100 * result_store.hits / max(result_store.hits + result_store.misses, 1)
+                                if result_store is not None else None},
+                'memo_states': sum(len(memo) for memo in scenario_memo.values()), 'engine': dict(self.engine)}
+
+    def emit(self, event='progress'):
+        snapshot = self.snapshot(event)
+        if event == 'summary':
+            snapshot['nodes_per_s'] = round(snapshot['nodes'] / max(snapshot['elapsed'], 1e-9))
+            snapshot['branching'] = {depth: round(children / expanded, 3)
+                                     for depth, (expanded, children) in sorted(self.totals()['branching'].items())}
+        self.stream.write(json.dumps(snapshot) + '\n')
+        self.stream.flush()
+        self.last_emit = time.perf_counter()
+        self.nodes_at_last_emit = snapshot['nodes']
+
+
+instrumentation: Instrumentation = None  # see enableInstrumentation
+uninstrumented = {}  # the functions enableInstrumentation replaced
+
+
+def resetForkedInstrumentation():
+    """In a forked worker process, the counters start from zero : the parent's ones aren't the worker's"""
+    global instrumentation
+    if instrumentation is not None:
+        instrumentation = Instrumentation(instrumentation.stream, instrumentation.interval)
+
+
+os.register_at_fork(after_in_child=resetForkedInstrumentation)
+
+
+def workerTask(function, *args):
+    """Runs function in a worker process. Returns its result, with the counters of the process if instrumented."""
+    result = function(*args)
+    if instrumentation is None:
+        return result, None
+    return result, ((os.getpid(), instrumentation.start), instrumentation.counters())
+
+
+def workerResult(task_result):
+    """Result of a workerTask, keeping the counters of its process for the emits of this one"""
+    result, counters = task_result
+    if counters is not None and instrumentation is not None:
+        worker, counters = counters
+        instrumentation.workers[worker] = counters  # counters add up since the worker started
+    return result
+
+
+def reportProgress(**progress):
+    """Progress of the engine fighting in this process, in the next emits. Nothing is kept when not instrumented."""
+    if instrumentation is not None:
+        instrumentation.engine.update(progress)
+
+
+def timedFunction(function, name):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            instrumentation.seconds[name] += time.perf_counter() - start
+            instrumentation.calls[name] += 1
+    return timed
+
+
+def countedNextTurns(previous_turn: TurnActions):
+    instrumentation.nodes += 1
+    counts = instrumentation.branching.setdefault(previous_turn.playerMod.turn, [0, 0])
+    counts[0] += 1
+    for next_turn in uninstrumented['nextTurns'](previous_turn):
+        counts[1] += 1
+        yield next_turn
+
+    if instrumentation.nodes % 1024 == 0 and time.perf_counter() - instrumentation.last_emit >= instrumentation.interval:
+        instrumentation.emit()
+
+
+def countedFightOutcome(t: TurnActions):
+    outcome = uninstrumented['fightOutcome'](t)
+    if outcome is None:
+        instrumentation.leaves['PRUNED'] += 1
+    elif outcome != FightOutcome.STILL_GOING:
+        instrumentation.leaves[outcome.name] += 1
+    return outcome
+
+
+def enableInstrumentation(stream=None, interval=10):
+    """Replaces the hot functions by counting and timing ones, which emit the counters as a JSON line every interval
+    seconds on stream (stderr by default). Until then, nothing is counted and nothing is slowed down.
+    Worker processes started afterwards count too."""
+    global instrumentation, nextTurns, fightOutcome, allDamage, enemyMoveOdds
+    if instrumentation is not None:
+        return instrumentation
+    instrumentation = Instrumentation(stream or sys.stderr, interval)
+
+    uninstrumented.update(nextTurns=nextTurns, fightOutcome=fightOutcome, allDamage=allDamage,
+                          enemyMoveOdds=enemyMoveOdds, copy=TurnActions.__copy__)
+    nextTurns = countedNextTurns
+    fightOutcome = countedFightOutcome
+    allDamage = timedFunction(allDamage, 'damage')
+    enemyMoveOdds = timedFunction(enemyMoveOdds, 'ai')
+    TurnActions.__copy__ = timedFunction(TurnActions.__copy__, 'copy')
+    return instrumentation
+
+
+def disableInstrumentation():
+    """Emits the final summary and puts the original functions back"""
+    global instrumentation, nextTurns, fightOutcome, allDamage, enemyMoveOdds
+    if instrumentation is None:
+        return
+    instrumentation.emit('summary')
+    instrumentation = None
+
+    nextTurns = uninstrumented['nextTurns']
+    fightOutcome = uninstrumented['fightOutcome']
+    allDamage = uninstrumented['allDamage']
+    enemyMoveOdds = uninstrumented['enemyMoveOdds']
+    TurnActions.__copy__ = uninstrumented['copy']
+    uninstrumented.clear()
 
 
 #
@@ -1021,12 +2980,23 @@ def fightUntilKO(previous_turn: TurnActions, initial_turn: TurnActions, outcomes
 
 
 # "globals"
-total_entries = 0
-
 TurnActions.MAX_BAD_OUTCOME = 2
 allow_crits_for_player = True
 allow_crits_for_enemy = True
-store_all_scenarii = False
+store_all_scenarii = False  # fightUntilKOMemoized only stores one scenario per final state
+anytime_bad_outcomes = 64  # remainingBadOutcomes of the --anytime starting turns : its budgets prune instead
+prune_epsilon = None  # Fraction : turns of lower odds aren't explored, instead of MAX_BAD_OUTCOME, see FightOutcome.PRUNED
+engine = Engine.MEMOIZED
+odds_backend = OddsBackend.EXACT  # see setOddsBackend and crossCheckOddsBackends
+scenario_workers = os.cpu_count()  # processes fighting the carry-over scenarios
+fight_workers = os.cpu_count()  # processes of Engine.PARALLEL
+parallel_split_depth = 4  # steps explored before Engine.PARALLEL splits the fight into subtrees
+result_store = ResultStore('emptydics/results', 512 << 20)  # None to always fight
+checkpoint_interval = 10  # seconds between two saves of the party loop progress, 0 to save after every scenario
+pipelined = False  # fights all the party at the same time, see fightPartyPipelined
+pipeline_workers = os.cpu_count()  # processes of each party member when pipelined
+pipeline_queue_size = 64  # starting turns waiting between two party members when pipelined
+instrumentation_interval = 10  # seconds between two JSON lines of --instrument
 
 
 # Player
@@ -1057,70 +3027,176 @@ scyther = Pokemon(SCYTHER, 16, [9, 8, 8, 8],
 
 
 party = [scyther]
-# oldOutcomesDic = OutcomesDic()
-with open('emptydics/Kakuna,TurnActions.MAX_BAD_OUTCOME=2,allow_crits_for_player=True,allow_crits_for_enemy=True,totodileDVs=[0, 0, 0, 0],player.currHP=43', 'rb') as file:
-    oldOutcomesDic: OutcomesDic = pickle.load(file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Odds of Totodile only using Rage against Bugsy')
+    parser.add_argument('--resume', action='store_true', help='continue the interrupted run with the same config')
+    parser.add_argument('--instrument', action='store_true', help='print counters as JSON lines on stderr')
+    parser.add_argument('--monte-carlo', type=int, metavar='SAMPLES',
+                        help='sample battles against the first party member instead of fighting every scenario')
+    parser.add_argument('--batch-monte-carlo', type=int, metavar='BATTLES',
+                        help='sample battles against Metapod, Kakuna then Scyther with numpy, from a full HP Totodile')
+    parser.add_argument('--prune-epsilon', type=Fraction, metavar='EPSILON',
+                        help='fight with Engine.FRONTIER, not exploring turns of lower odds but counting them in PRUNED, '
+                             'whatever their bad outcomes')
+    parser.add_argument('--anytime', action='store_true',
+                        help='explore the most probable turns against the first party member first, until a budget runs out')
+    parser.add_argument('--node-budget', type=int, metavar='TURNS', help='with --anytime, turns to explore at most')
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS', help='with --anytime, seconds to explore at most')
+    parser.add_argument('--bias', type=float, default=1,
+                        help='with --monte-carlo, multiplies the odds of the bad outcomes and weights the battles')
+    parser.add_argument('--target-width', type=float, help='stop sampling, or exploring with --anytime, once the intervals are this narrow')
+    parser.add_argument('--seed', type=int, default=0, help='seed of --monte-carlo and --batch-monte-carlo')
+    args = parser.parse_args()
+    if args.instrument:
+        enableInstrumentation(interval=instrumentation_interval)
+    if args.prune_epsilon is not None:
+        prune_epsilon = args.prune_epsilon
+        engine = engine if engine in PRUNING_ENGINES else Engine.FRONTIER
+
+    if args.batch_monte_carlo:
+        totodile = Pokemon(TOTODILE, 16, totodileDVs,
+                           868, 868, 1108, 1108, 1019, 1019, 1203, 1203, 800, 800,
+                           [RAGE], False,
+                           elementalBadgeBoosts, atkBadge=True, defBadge=False, spdBadge=False, spcBadge=False,
+                           totalExp=2733)
+        enemies = [metapod, kakuna, scyther]
+        start = time.perf_counter()
+        result, results = fightPartyBatch(totodile, enemies, args.batch_monte_carlo, args.seed,
+                                          target_width=args.target_width)
+        elapsed = time.perf_counter() - start
+        for enemy, enemy_result in zip(enemies, results):
+            print(f'Against {enemy.species.name} : {enemy_result.short_display()}')
+        print(f'Whole party : {result.short_display()}')
+        print(f'{result.samples / elapsed * 60:,.0f} battles per minute')
+        sys.exit(0)
+
+    # oldOutcomesDic = OutcomesDic()
+    input_path = 'emptydics/Kakuna,TurnActions.MAX_BAD_OUTCOME=2,allow_crits_for_player=True,allow_crits_for_enemy=True,totodileDVs=[0, 0, 0, 0],player.currHP=43'
+    oldOutcomesDic = loadOutcomesDic(input_path).toOddsBackend()
     print(oldOutcomesDic.short_display())  # To visually check the data is the desired one
 
-partialOutcomesList = []
-player = list(oldOutcomesDic[FightOutcome.ENEMY_IS_KO].keys())[0].player
-previous_enemy: Pokemon = list(oldOutcomesDic[FightOutcome.ENEMY_IS_KO].keys())[0].enemy  # None
+    partialOutcomesList = []
+    player = list(oldOutcomesDic[FightOutcome.ENEMY_IS_KO].keys())[0].player
+    previous_enemy: Pokemon = list(oldOutcomesDic[FightOutcome.ENEMY_IS_KO].keys())[0].enemy  # None
+
+    info_str = f'{TurnActions.MAX_BAD_OUTCOME=},{allow_crits_for_player=},{allow_crits_for_enemy=},{store_all_scenarii=},{totodileDVs=},{player.currHP=}'
+    print(info_str)
+
+    run_hash = configHash(runConfig(input_path, player))
+    first_stage, done, resumedOutcomesDic = 0, 0, None
+    progress = loadProgress(run_hash) if args.resume else None
+    if progress is not None:
+        config, oldOutcomesDic, resumedOutcomesDic = progress
+        first_stage, done, partialOutcomesList = config['stage'], config['done'], config['partial_outcomes']
+        previous_enemy = party[first_stage - 1] if first_stage > 0 else previous_enemy
+        print(f'Resuming against {party[first_stage].species.name} after {done} scenarios')
+    elif args.resume:
+        print('No progress saved for this config, starting over')
+
+    if args.monte_carlo:
+        enemy = party[first_stage]
+        turns = firstTurns(player, enemy) if len(oldOutcomesDic[FightOutcome.ENEMY_IS_KO]) == 0 \
+            else list(carryOverTurns(oldOutcomesDic, previous_enemy, enemy))
+        starting_odds = sum(oddsFraction(turn.odds) for turn in turns)
+        result = fightMonteCarlo(turns, args.monte_carlo, args.seed, args.target_width) if args.bias == 1 \
+            else fightImportanceSampling(turns, args.monte_carlo, args.bias, args.seed, args.target_width)
+        print(f'Against {enemy.species.name}, from {float(starting_odds):.6%} of the scenarios : {result.short_display()}')
+
+        exact_path = f'emptydics/{enemy.species.name},{info_str}_fromKakuna'
+        if os.path.exists(exact_path) or os.path.exists(exact_path + '.ckpt'):  # fought before with the same config
+            total_odds = loadOutcomesDic(exact_path).total_odds
+            total_odds[FightOutcome.PLAYER_IS_KO] -= oldOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO]
+            for outcome, odds in result.prunedOdds(total_odds, starting_odds).items():
+                print(f'{outcome.name}: {float(oddsFraction(total_odds[outcome])):.6%} for the exact engine, '
+                      f'which missed about {odds:.6%}')
+        sys.exit(0)
+
+    if args.anytime:
+        enemy = party[first_stage]
+        turns = firstTurns(player, enemy) if len(oldOutcomesDic[FightOutcome.ENEMY_IS_KO]) == 0 \
+            else list(carryOverTurns(oldOutcomesDic, previous_enemy, enemy))
+        for turn in turns:
+            turn.remainingBadOutcomes = anytime_bad_outcomes
+        starting_odds = sum(oddsFraction(turn.odds) for turn in turns)
+        anytimeOutcomesDic = OutcomesDic()
+        start = time.perf_counter()
+        explored = fightUntilKOAnytime(turns, anytimeOutcomesDic, args.node_budget, args.time_budget, args.target_width)
+        elapsed = time.perf_counter() - start
+        print(f'Against {enemy.species.name}, from {float(starting_odds):.6%} of the scenarios, {explored} turns explored '
+              f'in {elapsed:.2f}s : {anytimeOutcomesDic.short_display()}')
+        for outcome in [FightOutcome.PLAYER_IS_KO, FightOutcome.ENEMY_IS_KO]:
+            low, high = anytimeOutcomesDic.bounds(outcome)
+            print(f'{outcome.name} in [{float(low):.6%}, {float(high):.6%}]')
+        sys.exit(0)
+
+    pipelined_results = None
+    if pipelined:
+        turns = firstTurns(player, party[first_stage]) if len(oldOutcomesDic[FightOutcome.ENEMY_IS_KO]) == 0 \
+            else list(carryOverTurns(oldOutcomesDic, previous_enemy, party[first_stage]))
+        pipelined_results = dict(enumerate(fightPartyPipelined(turns, party[first_stage:]), first_stage))
+
+    for stage, enemy in enumerate(party):
+        if stage < first_stage:
+            continue
+        if resumedOutcomesDic is None:
+            saveProgress(progressInputPath(stage), oldOutcomesDic, {'run': run_hash, 'stage': stage})
+            done = 0
+
+        newOutcomesDic = OutcomesDic()
+        scenario_memo.clear()  # shared by all scenarios against this enemy
+        if len(oldOutcomesDic[FightOutcome.ENEMY_IS_KO]) == 0:
+            # First Pokémon
+            turns = firstTurns(player, enemy)
+        else:
+            # Other Pokémon
+            newOutcomesDic[FightOutcome.PLAYER_IS_KO] = oldOutcomesDic[FightOutcome.PLAYER_IS_KO]  # propagate player deaths
+            newOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO] = oldOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO]
+            newOutcomesDic.total_odds[FightOutcome.PRUNED] = oldOutcomesDic.total_odds[FightOutcome.PRUNED]
+
+            turns = list(carryOverTurns(oldOutcomesDic, previous_enemy, enemy))
+            print(f'{len(turns)} starting turns for {len(oldOutcomesDic[FightOutcome.ENEMY_IS_KO])} scenarios')
 
-info_str = f'{TurnActions.MAX_BAD_OUTCOME=},{allow_crits_for_player=},{allow_crits_for_enemy=},{store_all_scenarii=},{totodileDVs=},{player.currHP=}'
-print(info_str)
+        if resumedOutcomesDic is not None:
+            newOutcomesDic = resumedOutcomesDic  # already has the player deaths and the first done scenarios
+            resumedOutcomesDic = None
 
-for enemy in party:
-    newOutcomesDic = OutcomesDic()
-    enemyMod = StatModifier()
-    if len(oldOutcomesDic[FightOutcome.ENEMY_IS_KO]) == 0:
-        # First Pokémon
-        starting_turn = TurnActions("", player, enemy, playerMod, enemyMod, Odds(1, 1))
-        fightUntilKO(starting_turn, starting_turn, newOutcomesDic)
-    else:
-        # Other Pokémon
-        newOutcomesDic[FightOutcome.PLAYER_IS_KO] = oldOutcomesDic[FightOutcome.PLAYER_IS_KO]  # propagate player deaths
-        newOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO] = oldOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO]
-
-        for turn, tuplee in oldOutcomesDic[FightOutcome.ENEMY_IS_KO].items():
-            # Saving previous total odds
-            total_player_odds_before: Odds = newOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO]
-            total_enemy_odds_before: Odds = newOutcomesDic.total_odds[FightOutcome.ENEMY_IS_KO]
-            total_odds_before = total_player_odds_before + total_enemy_odds_before
-
-            odds: Odds = tuplee[OutcomesDic.TOTAL_ODDS_IDX]  # Odds are not copied, but that shouldn't matter because fightUntilKO copies everything itself
-            # Update player
-            turn.player.gainStatExp(previous_enemy.species)
-            turn.player.gainExp(previous_enemy.expGiven())
-
-            # Update scenario
-            turn.odds = odds
-            turn.hasEnemyPlayed = True
-            turn.hasPlayerPlayed = True
-            turn.wasPoisonApplied = True
-            turn.wasJustPoisoned = False
-            turn.enemy = enemy
-            turn.enemyMod = enemyMod
-            fightUntilKO(turn, turn, newOutcomesDic)
+        if pipelined_results is not None:  # only scale the results fought with odds of 1
+            scenarios = (pipelined_results[stage][startingKey(turn)].scaled(turn.odds) for turn in turns[done:])
+        else:
+            scenarios = fightScenarios(turns[done:])
 
+        last_save = time.perf_counter()
+        for turn, scenarioOutcomesDic in zip(turns[done:], scenarios):
             # Check if total added odds are valid for this scenario
-            total_player_odds_after: Odds = newOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO]
-            total_enemy_odds_after: Odds = newOutcomesDic.total_odds[FightOutcome.ENEMY_IS_KO]
-            total_odds_after = total_player_odds_after + total_enemy_odds_after
+            added_odds = scenarioOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO] \
+                         + scenarioOutcomesDic.total_odds[FightOutcome.ENEMY_IS_KO]
+            newOutcomesDic.merge(scenarioOutcomesDic)
 
-            if odds < total_odds_after - total_odds_before:
-                raise ValueError(f'Odds added for this scenario are too high. Maximum odds = {odds} < added = {total_odds_after - total_odds_before}. Starting turn:{turn}, {newOutcomesDic.short_display()}.')
+            if turn.odds < added_odds:
+                raise ValueError(f'Odds added for this scenario are too high. Maximum odds = {turn.odds} < added = {added_odds}. Starting turn:{turn}, {newOutcomesDic.short_display()}.')
             else:
-                print(f'{total_odds_after - total_odds_before} out of {odds} added for scenario {turn}')
-
-    oldOutcomesDic = newOutcomesDic
-    previous_enemy = enemy
-    partialOutcomesList.append(f'After {enemy.species.name}: {newOutcomesDic.short_display()}')
-    with open(f'emptydics/{enemy.species.name},{info_str}_fromKakuna', 'wb') as file:
-        pickle.dump(newOutcomesDic, file)
-
-# print total
-print(party)
-# print(oldOutcomesDic.full_display())
-print(info_str, f'{total_entries=}')
-print(*partialOutcomesList, sep='\n')
-print(f'playerKO_ratio={oldOutcomesDic.percentageOfPlayerDeaths()}%')
+                print(f'{added_odds} out of {turn.odds} added for scenario {turn}')
+
+            done += 1
+            if time.perf_counter() - last_save >= checkpoint_interval or done == len(turns):
+                saveProgress(PROGRESS_PATH, newOutcomesDic,
+                             {'run': run_hash, 'stage': stage, 'done': done, 'partial_outcomes': partialOutcomesList})
+                last_save = time.perf_counter()
+
+        oldOutcomesDic = newOutcomesDic
+        previous_enemy = enemy
+        partialOutcomesList.append(f'After {enemy.species.name}: {newOutcomesDic.short_display()}')
+        writeCheckpoint(f'emptydics/{enemy.species.name},{info_str}_fromKakuna.ckpt', newOutcomesDic,
+                        {'enemy': enemy.species.name, 'info': info_str})
+
+    clearProgress()
+
+    # print total
+    print(party)
+    # print(oldOutcomesDic.full_display())
+    print(info_str)
+    disableInstrumentation()  # final summary
+    print(*partialOutcomesList, sep='\n')
+    print(f'playerKO_ratio={oldOutcomesDic.percentageOfPlayerDeaths()}%')
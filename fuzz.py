@@ -0,0 +1,302 @@
+import argparse
+import json
+import random
+import signal
+import sys
+import time
+
+import busgy2
+from busgy2 import (Pokemon, StatModifier, Odds, TurnActions, OutcomesDic, Engine, LRUCache, SPECIES_BY_DEX,
+                    MOVES_BY_INDEX, RAGE, lowestExpForLevel)
+from benchmarks import totodile, enemies
+from golden import differences
+
+# Differential fuzzing : random small fights are run through every engine, whose results must be exactly the same.
+# A failing fight is shrunk to a minimal one, printed as JSON to replay with --replay.
+REFERENCE = 'RECURSIVE (no caches)'  # fightUntilKO with damage_cache and ai_cache disabled
+ENGINES = [REFERENCE] + [e.name for e in Engine]
+case_seconds = 2  # fights whose REFERENCE run takes longer are skipped, 0 for no limit
+
+# Simplest value of every field of a fight, the shrinker moves the fields towards them
+SIMPLEST = {
+    'max_bad_outcome': 0,
+    'allow_crits_for_player': False,
+    'allow_crits_for_enemy': False,
+    'player_dex': busgy2.TOTODILE.dex,
+    'player_level': 2,
+    'player_dvs': [0, 0, 0, 0],
+    'player_currHP': 1,
+    'player_isPoisoned': False,
+    'player_stages': [0, 0, 0],  # atk, deff, spd
+    'player_rageNb': 1,
+    'enemy_dex': busgy2.METAPOD.dex,
+    'enemy_level': 2,
+    'enemy_dvs': [0, 0, 0, 0],
+    'enemy_currHP': 1,
+    'enemy_moves': [],  # move indexes, at least one is kept
+    'enemy_stages': [0, 0, 0],
+    'enemy_furycutterNb': 0,
+    'turn': 20,  # of both StatModifiers, fightOutcome stops the fight after turn 20
+}
+CATEGORICAL = {'player_dex', 'enemy_dex'}  # only replaced by their simplest value
+
+# (player currHP, index in enemies()) of the fights checkBatchMonteCarlo plays : ones where both outcomes happen
+BATCH_CHECK_FIGHTS = [(None, 2), (20, 1), (10, 0), (10, 1)]  # None for full HP
+
+
+#
+# Fights
+#
+class CaseTooLong(Exception):
+    pass
+
+
+def raiseCaseTooLong(signum, frame):
+    raise CaseTooLong()
+
+
+def randomCase(rng: random.Random):
+    """Fields of a random small fight : few turns are left, and few bad outcomes are allowed"""
+    return {
+        'max_bad_outcome': rng.randint(0, 1),
+        'allow_crits_for_player': rng.random() < 0.5,
+        'allow_crits_for_enemy': rng.random() < 0.5,
+        'player_dex': rng.choice(list(SPECIES_BY_DEX)),
+        'player_level': rng.randint(2, 30),
+        'player_dvs': [rng.randint(0, 15) for _ in range(4)],
+        'player_currHP': rng.randint(1, 100),
+        'player_isPoisoned': rng.random() < 0.2,
+        'player_stages': [rng.randint(-6, 6) for _ in range(3)],
+        'player_rageNb': rng.randint(1, 8),
+        'enemy_dex': rng.choice(list(SPECIES_BY_DEX)),
+        'enemy_level': rng.randint(2, 30),
+        'enemy_dvs': [rng.randint(0, 15) for _ in range(4)],
+        'enemy_currHP': rng.randint(1, 100),
+        'enemy_moves': rng.sample(sorted(MOVES_BY_INDEX), rng.randint(1, 4)),
+        'enemy_stages': [rng.randint(-6, 6) for _ in range(3)],
+        'enemy_furycutterNb': rng.randint(0, 5),
+        'turn': rng.randint(0, 20) if rng.random() < 0.1 else rng.randint(14, 20),
+    }
+
+
+def casePokemon(case, side, moves):
+    species = SPECIES_BY_DEX[case[side + '_dex']]
+    level = case[side + '_level']
+    pokemon = Pokemon(species, level, case[side + '_dvs'], 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, moves, False,
+                      busgy2.elementalBadgeBoosts, totalExp=lowestExpForLevel(species.expCurve, level))
+    pokemon.currHP = min(case[side + '_currHP'], pokemon.hp)
+    return pokemon
+
+
+def caseTurn(case):
+    """Starting turn of the fight, TurnActions.MAX_BAD_OUTCOME must already be set"""
+    player = casePokemon(case, 'player', [RAGE])
+    player.isPoisoned = case['player_isPoisoned']
+    enemy = casePokemon(case, 'enemy', [MOVES_BY_INDEX[index] for index in case['enemy_moves']])
+
+    playerMod, enemyMod = StatModifier(turn=case['turn']), StatModifier(turn=case['turn'])
+    playerMod.atk, playerMod.deff, playerMod.spd = case['player_stages']
+    playerMod.rageNb = case['player_rageNb']
+    enemyMod.atk, enemyMod.deff, enemyMod.spd = case['enemy_stages']
+    enemyMod.furycutterNb = case['enemy_furycutterNb']
+    return TurnActions('', player, enemy, playerMod, enemyMod, Odds(1, 1))
+
+
+def runEngine(case, engine_name):
+    """OutcomesDic of the fight with engine_name, or the exception it raised"""
+    TurnActions.MAX_BAD_OUTCOME = case['max_bad_outcome']
+    busgy2.allow_crits_for_player = case['allow_crits_for_player']
+    busgy2.allow_crits_for_enemy = case['allow_crits_for_enemy']
+    busgy2.engine = Engine.RECURSIVE if engine_name == REFERENCE else Engine[engine_name]
+    caches = busgy2.damage_cache, busgy2.ai_cache
+    if engine_name == REFERENCE:
+        busgy2.damage_cache, busgy2.ai_cache = LRUCache(0), LRUCache(0)
+
+    outcomesDic = OutcomesDic()
+    try:
+        if engine_name == REFERENCE and case_seconds:
+            signal.setitimer(signal.ITIMER_REAL, case_seconds)
+        busgy2.runFight(caseTurn(case), outcomesDic, {})
+    except CaseTooLong:
+        raise
+    except Exception as e:
+        return e
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        busgy2.damage_cache, busgy2.ai_cache = caches
+    return outcomesDic
+
+
+def caseFailures(case, engines):
+    """Descriptions of how the engines disagree with REFERENCE on case, empty if they all agree.
+    Raises CaseTooLong if REFERENCE takes more than case_seconds."""
+    expected = runEngine(case, REFERENCE)
+    if isinstance(expected, Exception):
+        return [f'{REFERENCE} raised {type(expected).__name__}: {expected}']
+
+    found = []
+    for engine_name in engines:
+        if engine_name == REFERENCE:
+            continue
+        actual = runEngine(case, engine_name)
+        if isinstance(actual, Exception):
+            found.append(f'{engine_name} raised {type(actual).__name__}: {actual}')
+        else:
+            found.extend(f'{engine_name}: {difference}' for difference in differences(expected, actual))
+    return found
+
+
+#
+# Shrinking
+#
+def simplerValues(field, value, simplest):
+    """Values between value and simplest, the simplest ones first"""
+    if isinstance(value, bool) or value == simplest or field in CATEGORICAL:
+        return [simplest] if value != simplest else []
+    values = [simplest, (value + simplest) // 2, value - 1 if value > simplest else value + 1]
+    return [v for i, v in enumerate(values) if v != value and v not in values[:i]]
+
+
+def simplerCases(case):
+    """Every case differing from case by one field moved towards SIMPLEST"""
+    for field, simplest in SIMPLEST.items():
+        value = case[field]
+        if field == 'enemy_moves':
+            for i in range(len(value) if len(value) > 1 else 0):
+                yield dict(case, enemy_moves=value[:i] + value[i + 1:])
+        elif isinstance(value, list):
+            for i, element in enumerate(value):
+                for simpler in simplerValues(field, element, simplest[i]):
+                    yield dict(case, **{field: value[:i] + [simpler] + value[i + 1:]})
+        else:
+            for simpler in simplerValues(field, value, simplest):
+                yield dict(case, **{field: simpler})
+
+
+def shrink(case, engines):
+    """Smallest case found, by simplifying one field at a time, that still makes the engines disagree"""
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for simpler in simplerCases(case):
+            try:
+                if caseFailures(simpler, engines):
+                    case, shrunk = simpler, True
+                    break
+            except CaseTooLong:
+                continue
+    return case
+
+
+def checkDamageParity():
+    """Compares calc_damage_batch to calc_damage for every damaging move of the Bugsy fights, which raises ValueError on
+    the first difference, or ImportError if numpy is missing"""
+    player = totodile()
+    for enemy in enemies():
+        busgy2.checkBatchDamageParity(RAGE, player, enemy)
+        for move in enemy.moves:
+            if move.power >= 2:
+                busgy2.checkBatchDamageParity(move, enemy, player, [1 << n for n in range(6)])  # Fury Cutter
+
+
+def checkBatchMonteCarlo(battles=10000, seed=0):
+    """Plays battles of each of BATCH_CHECK_FIGHTS with fightPartyBatch and fightMonteCarlo, from the same starting
+    turn and seed so that runs are reproducible. Returns (player, enemy, fightMonteCarlo result, fightPartyBatch
+    result) for each fight. Raises ValueError if their intervals of an outcome don't overlap, ImportError without
+    numpy."""
+    results = []
+    for currHP, enemy_index in BATCH_CHECK_FIGHTS:
+        player, enemy = totodile(), enemies()[enemy_index]
+        player.currHP = player.hp if currHP is None else currHP
+        batch, _ = busgy2.fightPartyBatch(player, [enemy], battles, seed)
+        starting_turn = TurnActions('', player, enemy, busgy2.playerMod, StatModifier(), Odds(1, 1))  # like fightPartyBatch
+        scalar = busgy2.fightMonteCarlo([starting_turn], battles, seed)
+        for outcome in scalar.counts:
+            (low, high), (batch_low, batch_high) = scalar.interval(outcome), batch.interval(outcome)
+            if batch_high < low or high < batch_low:
+                raise ValueError(f'Against {enemy.species.name} from {player.currHP} HP, {outcome.name} is in '
+                                 f'[{low:.4%}, {high:.4%}] for fightMonteCarlo, [{batch_low:.4%}, {batch_high:.4%}] '
+                                 f'for fightPartyBatch')
+        results.append((player, enemy, scalar, batch))
+    return results
+
+
+def reportFailure(case, engines, failures):
+    for description in failures[:10]:
+        print('    ' + description)
+    print('Replay with:')
+    print(f"    python fuzz.py --engines {' '.join(repr(e) for e in engines)} --replay '{json.dumps(case)}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Differential fuzzing of the busgy2.py engines')
+    parser.add_argument('--cases', type=int, default=100, help='random fights to run')
+    parser.add_argument('--seed', type=int, default=None, help='random by default, always printed')
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES,
+                        help=f'compared to {REFERENCE}, which always runs')
+    parser.add_argument('--replay', help='runs the fight of this JSON case only')
+    parser.add_argument('--no-shrink', action='store_true', help='reports failing fights as they were generated')
+    parser.add_argument('--no-damage-parity', action='store_true',
+                        help='skips comparing the numpy damage calculator to the scalar one first, which fails '
+                             'without numpy')
+    parser.add_argument('--no-batch-monte-carlo', action='store_true',
+                        help='skips comparing the numpy Monte Carlo engine to the scalar one first, which fails '
+                             'without numpy')
+    parser.add_argument('--case-seconds', type=float, default=case_seconds,
+                        help=f'fights whose {REFERENCE} run takes longer are skipped')
+    args = parser.parse_args()
+    case_seconds = args.case_seconds
+    signal.signal(signal.SIGALRM, raiseCaseTooLong)
+
+    if args.replay:
+        case_seconds = 0
+        case = json.loads(args.replay)
+        failures = caseFailures(case, args.engines)
+        if not failures:
+            print('No difference')
+            sys.exit(0)
+        reportFailure(case, args.engines, failures)
+        sys.exit(1)
+
+    if not args.no_damage_parity:
+        try:
+            checkDamageParity()
+        except (ValueError, ImportError) as e:
+            print(f'Damage parity : {e}')
+            sys.exit(1)
+        print('Damage parity : ok')
+
+    if not args.no_batch_monte_carlo:
+        try:
+            batch_results = checkBatchMonteCarlo()
+        except (ValueError, ImportError) as e:
+            print(f'Batch Monte Carlo : {e}')
+            sys.exit(1)
+        print('Batch Monte Carlo : ok, PLAYER_IS_KO ' + ', '.join(
+            f'{scalar.estimate(busgy2.FightOutcome.PLAYER_IS_KO):.2%} and '
+            f'{batch.estimate(busgy2.FightOutcome.PLAYER_IS_KO):.2%} against {enemy.species.name} from '
+            f'{player.currHP} HP' for player, enemy, scalar, batch in batch_results))
+
+    seed = random.randrange(1 << 32) if args.seed is None else args.seed
+    rng = random.Random(seed)
+    print(f'{seed=}')
+    start = time.perf_counter()
+    skipped = 0
+    for i in range(args.cases):
+        case = randomCase(rng)
+        try:
+            failures = caseFailures(case, args.engines)
+        except CaseTooLong:
+            skipped += 1
+            continue
+        if failures:
+            print(f'Case {i} makes the engines disagree : {json.dumps(case)}')
+            if not args.no_shrink:
+                case = shrink(case, args.engines)
+                print(f'Shrunk to : {json.dumps(case)}')
+                case_seconds = 0
+                failures = caseFailures(case, args.engines)
+            reportFailure(case, args.engines, failures)
+            sys.exit(1)
+    print(f'{args.cases - skipped} fights, no difference, {skipped} skipped as too long, '
+          f'{time.perf_counter() - start:.1f}s')
@@ -0,0 +1,174 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import time
+
+import busgy2
+from busgy2 import FightOutcome, OutcomesDic, StatModifier, TurnActions, Odds, oddsFraction
+from benchmarks import totodile
+
+# Golden results : recomputes the fights saved in emptydics and compares their odds exactly, as rationals.
+# The fast tier runs in seconds, the full tier takes the time of a MAX_BAD_OUTCOME=2 run with crits.
+EMPTYDICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emptydics')
+
+
+# Checkpoints saved by other versions of the rules. Running the unmodified first version of busgy2.py on the Scyther
+# MAX_BAD_OUTCOME=1 chain (with its "Odds added for this scenario are too high" check disabled) gave the same results
+# as RULES_VERSION 1, and the MAX_BAD_OUTCOME=2 one differed from the _fromKakuna checkpoint, fought from the same Kakuna
+# results. RULES_VERSION 2 explores the turns following a poison tick once, where all the checkpoints counted them twice.
+# Each one is (number of differing odds, differencesDigest of them, why) : any other difference fails.
+KNOWN_DIFFERENCES = {
+    'Scyther,TurnActions.MAX_BAD_OUTCOME=1,allow_crits_for_player=False,allow_crits_for_enemy=False,'
+    'totodileDVs=[0, 0, 0, 0],player.currHP=43':
+        (38, '4a79d3cb59ce47dc9bb6e51a1e0cb9b12a7af182f7a31efc15814a452a3bb172',
+         'ENEMY_IS_KO=9.964286631958% instead of 10.710556390718%, in 37 entries'),
+    'Kakuna,TurnActions.MAX_BAD_OUTCOME=2,allow_crits_for_player=True,allow_crits_for_enemy=True,'
+    'totodileDVs=[0, 0, 0, 0],player.currHP=43':
+        (14, '81f407728d408a0a6ac0a5d505a16302ca43070c321a561848b72a6475e457f7',
+         'ENEMY_IS_KO=73.218334255621% instead of 73.372054691839%, in 13 entries'),
+    'Scyther,TurnActions.MAX_BAD_OUTCOME=2,allow_crits_for_player=True,allow_crits_for_enemy=True,'
+    'totodileDVs=[0, 0, 0, 0],player.currHP=43':
+        (505, 'a18441167e3cd87bbd4ea28bf1be08b9002514e1ad11b0d582d8b327e64a068a',
+         'PLAYER_IS_KO=7.444393870943% instead of 7.818604511821%'),
+    'Scyther,TurnActions.MAX_BAD_OUTCOME=2,allow_crits_for_player=True,allow_crits_for_enemy=True,'
+    'store_all_scenarii=False,totodileDVs=[0, 0, 0, 0],player.currHP=31_fromKakuna':
+        (265, '1a7682339fe12bd18f52c77119b4ab1a3cb967d6ecee5c9ceb0cfd8885bba64b',
+         'PLAYER_IS_KO=7.450844273943% instead of 7.820056094317%'),
+}
+
+
+class Golden:
+    def __init__(self, filename, enemies, max_bad_outcome, crits, tier, input_filename=None):
+        self.filename = filename
+        self.enemies = enemies  # fought one after the other, starting from a full HP Totodile or input_filename
+        self.max_bad_outcome = max_bad_outcome
+        self.crits = crits  # allow_crits_for_player and allow_crits_for_enemy
+        self.tier = tier
+        self.input_filename = input_filename
+        self.known_differences = KNOWN_DIFFERENCES.get(filename)  # (number of differences, digest, why)
+
+    def __repr__(self):
+        return self.filename
+
+
+def emptydicsName(enemy_name, max_bad_outcome, crits, suffix=''):
+    return f'{enemy_name},TurnActions.MAX_BAD_OUTCOME={max_bad_outcome},allow_crits_for_player={crits},' \
+           f'allow_crits_for_enemy={crits},totodileDVs=[0, 0, 0, 0],player.currHP=43{suffix}'
+
+
+GOLDENS = [Golden(emptydicsName(enemies[-1].species.name, max_bad_outcome, crits), enemies, max_bad_outcome, crits,
+                  'fast' if max_bad_outcome < 2 else 'full')
+           for max_bad_outcome, crits in [(0, False), (1, False), (2, True)]
+           for enemies in [[busgy2.metapod], [busgy2.metapod, busgy2.kakuna],
+                           [busgy2.metapod, busgy2.kakuna, busgy2.scyther]]] \
+          + [Golden('Scyther,TurnActions.MAX_BAD_OUTCOME=2,allow_crits_for_player=True,allow_crits_for_enemy=True,'
+                    'store_all_scenarii=False,totodileDVs=[0, 0, 0, 0],player.currHP=31_fromKakuna',
+                    [busgy2.scyther], 2, True, 'full', input_filename=emptydicsName('Kakuna', 2, True))]
+
+
+def fightChain(golden: Golden):
+    """Fights golden's enemies like the busgy2.py party loop does"""
+    TurnActions.MAX_BAD_OUTCOME = golden.max_bad_outcome
+    busgy2.allow_crits_for_player = busgy2.allow_crits_for_enemy = golden.crits
+    busgy2.result_store = None  # always fight
+
+    previous_enemy = None
+    outcomesDic = OutcomesDic()
+    if golden.input_filename:
+        outcomesDic = busgy2.loadOutcomesDic(os.path.join(EMPTYDICS, golden.input_filename))
+        previous_enemy = list(outcomesDic[FightOutcome.ENEMY_IS_KO].keys())[0].enemy
+
+    for enemy in golden.enemies:
+        busgy2.scenario_memo.clear()
+        newOutcomesDic = OutcomesDic()
+        if previous_enemy is None:
+            starting_turn = TurnActions('', totodile(), enemy, StatModifier(), StatModifier(), Odds(1, 1))
+            busgy2.runFight(starting_turn, newOutcomesDic, busgy2.scenario_memo)
+        else:
+            newOutcomesDic[FightOutcome.PLAYER_IS_KO] = outcomesDic[FightOutcome.PLAYER_IS_KO]
+            newOutcomesDic.total_odds[FightOutcome.PLAYER_IS_KO] = outcomesDic.total_odds[FightOutcome.PLAYER_IS_KO]
+            turns = list(busgy2.carryOverTurns(outcomesDic, previous_enemy, enemy))
+            for scenarioOutcomesDic in busgy2.fightScenarios(turns):
+                newOutcomesDic.merge(scenarioOutcomesDic)
+        outcomesDic = newOutcomesDic
+        previous_enemy = enemy
+    return outcomesDic
+
+
+def exactOdds(outcomesDic: OutcomesDic):
+    """{outcome: ({entry key: odds}, total odds)}, odds being Fractions"""
+    return {outcome: ({hash(t): oddsFraction(odds) for t, (odds, _) in outcomesDic[outcome].items()},
+                      oddsFraction(outcomesDic.total_odds[outcome]))
+            for outcome in [FightOutcome.PLAYER_IS_KO, FightOutcome.ENEMY_IS_KO]}
+
+
+def differingOdds(expected: OutcomesDic, actual: OutcomesDic):
+    """[(outcome name, entry key or None for the total, expected odds, computed odds)] of the differing odds, sorted"""
+    found = []
+    actual_odds = exactOdds(actual)
+    for outcome, (entries, total) in exactOdds(expected).items():
+        actual_entries, actual_total = actual_odds[outcome]
+        if total != actual_total:
+            found.append((outcome.name, None, total, actual_total))
+        for key in sorted(entries.keys() | actual_entries.keys()):
+            if entries.get(key) != actual_entries.get(key):
+                found.append((outcome.name, key, entries.get(key), actual_entries.get(key)))
+    return found
+
+
+def differencesDigest(found):
+    """Hash of the exact keys and odds of differingOdds"""
+    return hashlib.sha256(repr(found).encode()).hexdigest()
+
+
+def describeDifferences(found):
+    return [f'{outcome} total: {float(total):.12%} expected, {float(actual_total):.12%} computed' if key is None
+            else f'{outcome} entry {key}: {total} expected, {actual_total} computed'
+            for outcome, key, total, actual_total in found]
+
+
+def differences(expected: OutcomesDic, actual: OutcomesDic):
+    """Descriptions of the differing odds, empty if both have exactly the same"""
+    return describeDifferences(differingOdds(expected, actual))
+
+
+def checkGolden(golden: Golden):
+    """Differences between the checkpoint and the recomputed fight, as differingOdds"""
+    with open(os.path.join(EMPTYDICS, golden.filename), 'rb') as file:
+        expected = busgy2.CheckpointUnpickler(file).load()
+    with contextlib.redirect_stdout(io.StringIO()):
+        actual = fightChain(golden)
+    return differingOdds(expected, actual)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares busgy2.py results to the emptydics checkpoints')
+    parser.add_argument('--tier', choices=['fast', 'full'], default='fast', help='full also runs the fast tier')
+    parser.add_argument('--engine', default=busgy2.engine.name, choices=[e.name for e in busgy2.Engine])
+    parser.add_argument('--odds-backend', default=busgy2.odds_backend.name, choices=[b.name for b in busgy2.OddsBackend])
+    args = parser.parse_args()
+    busgy2.engine = busgy2.Engine[args.engine]
+    busgy2.setOddsBackend(busgy2.OddsBackend[args.odds_backend])
+
+    failures = 0
+    for golden in GOLDENS:
+        if args.tier == 'fast' and golden.tier != 'fast':
+            continue
+        start = time.perf_counter()
+        found = checkGolden(golden)
+        known = golden.known_differences is not None \
+            and (len(found), differencesDigest(found)) == golden.known_differences[:2]
+        status = 'known' if known else 'FAIL' if found or golden.known_differences else 'ok'
+        print(f'{status:5} {time.perf_counter() - start:8.2f}s {golden}', flush=True)
+        if known:
+            print(f'    {len(found)} differences, as expected : {golden.known_differences[2]}')
+        else:
+            for difference in describeDifferences(found)[:5] + ([f'... {len(found) - 5} more'] if len(found) > 5 else []):
+                print('    ' + difference)
+            if found:
+                print(f'    {len(found)} differences, digest {differencesDigest(found)}')
+        failures += status == 'FAIL'
+    sys.exit(1 if failures else 0)
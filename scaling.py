@@ -0,0 +1,114 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import busgy2
+from benchmarks import totodile
+
+# End-to-end scaling benchmark : every enemy fought on its own by a full HP Totodile,
+# at every MAX_BAD_OUTCOME and crit setting. Each run is a separate process, killed once it exceeds the time budget.
+ENEMIES = {'Metapod': busgy2.metapod, 'Kakuna': busgy2.kakuna, 'Scyther': busgy2.scyther}
+MAX_BAD_OUTCOMES = [0, 1, 2, 3]
+# (allow_crits_for_player, allow_crits_for_enemy) : doPlayerTurn reads the first one, doEnemyTurn the second one
+CRITS = [(False, False), (True, False), (False, True), (True, True)]
+COLUMNS = ['enemy', 'MAX_BAD_OUTCOME', 'allow_crits_for_player', 'allow_crits_for_enemy', 'engine', 'status',
+           'wall_s', 'growth', 'peak_rss_mb', 'leaves', 'distinct_states', 'player_ko_percent']
+
+
+def runOnce(enemy_name, max_bad_outcome, allow_crits_for_player, allow_crits_for_enemy, engine_name):
+    """Fights in this process, returns the row of the run. Counters come from busgy2's instrumentation."""
+    busgy2.TurnActions.MAX_BAD_OUTCOME = max_bad_outcome
+    busgy2.allow_crits_for_player = allow_crits_for_player
+    busgy2.allow_crits_for_enemy = allow_crits_for_enemy
+    busgy2.engine = busgy2.Engine[engine_name]
+    busgy2.result_store = None  # always fight
+    instrumentation = busgy2.enableInstrumentation(io.StringIO(), interval=float('inf'))
+
+    starting_turn = busgy2.TurnActions('', totodile(), ENEMIES[enemy_name].__copy__(),
+                                       busgy2.StatModifier(), busgy2.StatModifier(), busgy2.Odds(1, 1))
+    outcomesDic = busgy2.OutcomesDic()
+    start = time.perf_counter()
+    busgy2.runFight(starting_turn, outcomesDic, busgy2.scenario_memo)
+    wall = time.perf_counter() - start
+
+    totals = instrumentation.totals()  # Engine.PARALLEL counts in its worker processes
+    leaves = totals['leaves']
+    return {'status': 'ok', 'wall_s': round(wall, 3),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'leaves': leaves[busgy2.FightOutcome.PLAYER_IS_KO.name] + leaves[busgy2.FightOutcome.ENEMY_IS_KO.name],
+            # every expanded turn is a distinct state for the memoized engine, not for the others
+            'distinct_states': sum(len(memo) for memo in busgy2.scenario_memo.values()) or totals['nodes'],
+            'player_ko_percent': outcomesDic.total_odds[busgy2.FightOutcome.PLAYER_IS_KO].percentage()}
+
+
+def runAll(enemies, max_bad_outcomes, engine_name, budget):
+    """Rows of every run. Once a run times out, the same fight with a higher MAX_BAD_OUTCOME is skipped."""
+    rows = []
+    for enemy_name, (allow_crits_for_player, allow_crits_for_enemy) in itertools.product(enemies, CRITS):
+        previous = None
+        for max_bad_outcome in max_bad_outcomes:
+            row = {'enemy': enemy_name, 'MAX_BAD_OUTCOME': max_bad_outcome,
+                   'allow_crits_for_player': allow_crits_for_player, 'allow_crits_for_enemy': allow_crits_for_enemy,
+                   'engine': engine_name}
+            if previous is not None and previous['status'] != 'ok':
+                row['status'] = 'skipped'
+            else:
+                command = [sys.executable, __file__, '--run', enemy_name, str(max_bad_outcome),
+                           str(allow_crits_for_player), str(allow_crits_for_enemy), '--engine', engine_name]
+                try:
+                    process = subprocess.run(command, capture_output=True, text=True, timeout=budget)
+                    if process.returncode == 0:
+                        row.update(json.loads(process.stdout.splitlines()[-1]))
+                    else:
+                        row['status'] = 'error'
+                        print(process.stderr, file=sys.stderr)
+                except subprocess.TimeoutExpired:
+                    row['status'] = 'timeout'
+                if row['status'] == 'ok' and previous is not None:
+                    row['growth'] = round(row['wall_s'] / max(previous['wall_s'], 1e-3), 2)
+            rows.append(row)
+            previous = row
+            printRow(row)
+    return rows
+
+
+def printRow(row):
+    crits = ('P' if row['allow_crits_for_player'] else '-') + ('E' if row['allow_crits_for_enemy'] else '-')
+    if row['status'] != 'ok':
+        print(f'{row["enemy"]:8} {row["MAX_BAD_OUTCOME"]:3} {crits:5} {row["status"]}', flush=True)
+        return
+    growth = f'x{row["growth"]}' if 'growth' in row else ''
+    print(f'{row["enemy"]:8} {row["MAX_BAD_OUTCOME"]:3} {crits:5} {row["wall_s"]:10.2f}s {growth:>8} '
+          f'{row["peak_rss_mb"]:8.1f}MB {row["leaves"]:10} leaves {row["distinct_states"]:10} states '
+          f'{row["player_ko_percent"]:9.4f}% PLAYER_KO', flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scaling of busgy2.py fights with MAX_BAD_OUTCOME and crits')
+    parser.add_argument('--enemies', nargs='+', default=list(ENEMIES), choices=list(ENEMIES))
+    parser.add_argument('--max-bad-outcomes', nargs='+', type=int, default=MAX_BAD_OUTCOMES)
+    parser.add_argument('--engine', default=busgy2.Engine.MEMOIZED.name, choices=[e.name for e in busgy2.Engine])
+    parser.add_argument('--budget', type=float, default=600, help='seconds before a run is marked as timed out')
+    parser.add_argument('--csv', default='scaling.csv', help='where to write every run')
+    parser.add_argument('--run', nargs=4, metavar=('ENEMY', 'MAX_BAD_OUTCOME', 'PLAYER_CRITS', 'ENEMY_CRITS'),
+                        help='fight once in this process and print its row as JSON (used by the harness)')
+    args = parser.parse_args()
+
+    if args.run:
+        enemy_name, max_bad_outcome, allow_crits_for_player, allow_crits_for_enemy = args.run
+        print(json.dumps(runOnce(enemy_name, int(max_bad_outcome), allow_crits_for_player == 'True',
+                                 allow_crits_for_enemy == 'True', args.engine)))
+    else:
+        print('enemy    MBO crits (P = player, E = enemy)')
+        rows = runAll(args.enemies, args.max_bad_outcomes, args.engine, args.budget)
+        with open(args.csv, 'w', newline='') as file:
+            writer = csv.DictWriter(file, COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f'{len(rows)} runs written to {args.csv}')